@@ -1,16 +1,42 @@
 """
 Security and authentication utilities
+
+Access tokens carry `iat`/`exp` and a `jti`. Decoded tokens and user
+records are kept in bounded TTL caches so the hot path does no crypto
+work or database reads. Logout revokes a token through the
+`revoked_tokens` collection; other workers notice within AUTH_CACHE_TTL.
 """
+import asyncio
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import bcrypt
 import jwt
+from bson import ObjectId
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.cache import LRUCache
+from app.database import user_collection, revoked_token_collection
 
 # Security configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+ACCESS_TOKEN_TTL = int(os.getenv("ACCESS_TOKEN_TTL", "86400"))  # seconds
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))  # seconds a decoded token or user record is reused
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
 security = HTTPBearer()
 
+_token_cache = LRUCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_user_cache = LRUCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
@@ -22,24 +48,96 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether a stored hash was made with a different bcrypt cost than configured"""
+    # Hashes look like $2b$12$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password on the hashing pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the hashing pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict) -> str:
-    """Create a JWT access token"""
-    return jwt.encode(data, SECRET_KEY, algorithm="HS256")
+    """Create a JWT access token valid for ACCESS_TOKEN_TTL seconds"""
+    now = int(time.time())
+    claims = {**data, "iat": now, "exp": now + ACCESS_TOKEN_TTL, "jti": uuid.uuid4().hex}
+    return jwt.encode(claims, SECRET_KEY, algorithm="HS256")
 
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Verify and decode a JWT token"""
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload
-    except jwt.PyJWTError:
+def _unauthorized() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid authentication credentials"
+    )
+
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Verify and decode a JWT token, reusing recently decoded tokens"""
+    token = credentials.credentials
+    payload = _token_cache.get(token)
+    if payload is None:
+        try:
+            # Tokens issued without an expiry are no longer accepted
+            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], options={"require": ["exp", "iat", "jti"]})
+        except jwt.PyJWTError:
+            raise _unauthorized()
+        if await revoked_token_collection.find_one({"_id": payload["jti"]}, {"_id": 1}):
+            raise _unauthorized()
+        _token_cache.set(token, payload)
+    elif payload["exp"] <= time.time():
+        _token_cache.pop(token)
+        raise _unauthorized()
+    return payload
+
+
+async def revoke_token(token: str, payload: dict):
+    """Reject this token from now on; the record expires together with the token"""
+    _token_cache.pop(token)
+    await revoked_token_collection.update_one(
+        {"_id": payload["jti"]},
+        {"$set": {"expires_at": datetime.fromtimestamp(payload["exp"], timezone.utc).replace(tzinfo=None)}},
+        upsert=True
+    )
+
+
+async def get_user(user_id: str):
+    """User record without the password hash, cached for AUTH_CACHE_TTL"""
+    user = _user_cache.get(user_id)
+    if user is None:
+        user = await user_collection.find_one({"_id": ObjectId(user_id)}, {"password": 0})
+        if user is not None:
+            _user_cache.set(user_id, user)
+    return user
+
+
+def invalidate_user(user_id: str):
+    """Drop a cached user record after it changed"""
+    _user_cache.pop(user_id)
+
+
+async def get_current_user(token_data: dict = Depends(verify_token)) -> dict:
+    """The authenticated user's record"""
+    user = await get_user(token_data["user_id"])
+    if user is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials"
+            status_code=404,
+            detail="User not found"
         )
+    return user
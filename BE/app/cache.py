@@ -0,0 +1,125 @@
+"""
+Content-addressed summary cache: in-process LRU tier plus optional MongoDB TTL tier
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from app.database import summary_cache_collection
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "10000"))
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "86400"))  # seconds
+SUMMARY_CACHE_PERSIST = os.getenv("SUMMARY_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so trivially different copies share a cache entry"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def make_key(text: str, model: str, prompt: str, params: dict) -> str:
+    """Hash of the normalized text plus everything that affects the output"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([model, prompt, params], sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Bounded in-memory cache with least-recently-used eviction and a per-entry TTL"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SummaryCache:
+    """Two-tier summary cache with hit/miss counters"""
+
+    def __init__(self, collection=None, maxsize: int = SUMMARY_CACHE_SIZE, ttl: int = SUMMARY_CACHE_TTL):
+        self.memory = LRUCache(maxsize, ttl)
+        self.collection = collection
+        self.ttl = ttl
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self):
+        """Create the TTL index that expires persistent entries"""
+        if self.collection is not None:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+        if self.collection is not None:
+            doc = await self.collection.find_one(
+                {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+                {"value": 1}
+            )
+            if doc:
+                self.persistent_hits += 1
+                self.memory.set(key, doc["value"])
+                return doc["value"]
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value):
+        self.memory.set(key, value)
+        if self.collection is not None:
+            now = datetime.utcnow()
+            await self.collection.replace_one(
+                {"_id": key},
+                {"value": value, "created_at": now, "expires_at": now + timedelta(seconds=self.ttl)},
+                upsert=True
+            )
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.persistent_hits
+        lookups = hits + self.misses
+        return {
+            "size": len(self.memory),
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+summary_cache = SummaryCache(summary_cache_collection if SUMMARY_CACHE_PERSIST else None)
@@ -0,0 +1,36 @@
+"""
+Response compression: brotli when brotli-asgi is installed, gzip otherwise
+"""
+import os
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # optional: pip install brotli-asgi
+    BrotliMiddleware = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # bytes; smaller responses are sent as is
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))  # higher levels cost far more CPU for a few percent
+
+
+class CompressionMiddleware:
+    """Compress responses the client accepts compressed.
+
+    Streamed token responses are excluded: the compressor buffers its
+    input, which would hold tokens back until a block fills up.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, exempt_suffixes: tuple = ("/stream",)):
+        self.app = app
+        self.exempt_suffixes = exempt_suffixes
+        if BrotliMiddleware is not None:
+            self.compressed = BrotliMiddleware(app, quality=BROTLI_QUALITY, minimum_size=minimum_size)
+        else:
+            self.compressed = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=GZIP_LEVEL)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].rstrip("/").endswith(self.exempt_suffixes):
+            await self.app(scope, receive, send)
+            return
+        await self.compressed(scope, receive, send)
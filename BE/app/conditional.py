@@ -0,0 +1,92 @@
+"""
+Version counters and conditional GET for the listing endpoints
+
+Each history keeps a `version` that every message write increments, and
+each user a `history_version` that creating, importing or deleting one of
+their histories increments. The listings derive their ETag from that
+counter, so a matching If-None-Match is answered with 304 after one
+_id lookup, without reading the messages or histories.
+
+Writers bump the counter after their write and readers read it before
+theirs. A reader racing a writer can then only tag new content with the
+old version, which costs a refetch, never a stale 304.
+"""
+from email.utils import format_datetime
+from datetime import timezone
+from bson import ObjectId
+from fastapi import Request, Response, status
+from app.database import history_collection, user_collection
+from app.utils import mongo_now
+
+
+async def bump_history(history_id: str):
+    """Record a change to the messages of a history"""
+    if ObjectId.is_valid(history_id):
+        await history_collection.update_one(
+            {"_id": ObjectId(history_id)},
+            {"$set": {"updated_at": mongo_now()}, "$inc": {"version": 1}}
+        )
+
+
+async def bump_user_histories(user_id: str):
+    """Record a change to the list of a user's histories"""
+    if ObjectId.is_valid(user_id):
+        await user_collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"history_updated_at": mongo_now()}, "$inc": {"history_version": 1}}
+        )
+
+
+def _etag(key: str, version) -> str:
+    return f'W/"{key}-{version or 0}"'
+
+
+async def get_history_version(history_id: str):
+    """Version fields and archived flag of a history, None if it does not exist"""
+    if not ObjectId.is_valid(history_id):
+        return None
+    return await history_collection.find_one(
+        {"_id": ObjectId(history_id)},
+        {"version": 1, "updated_at": 1, "created_at": 1, "archived": 1}
+    )
+
+
+def history_etag(history: dict) -> tuple:
+    """(etag, last_modified) of a history's messages"""
+    return _etag(str(history["_id"]), history.get("version")), history.get("updated_at") or history.get("created_at")
+
+
+async def user_histories_etag(user_id: str):
+    """(etag, last_modified) of a user's history list, None if the user does not exist"""
+    if not ObjectId.is_valid(user_id):
+        return None
+    doc = await user_collection.find_one(
+        {"_id": ObjectId(user_id)},
+        {"history_version": 1, "history_updated_at": 1}
+    )
+    if doc is None:
+        return None
+    return _etag(user_id, doc.get("history_version")), doc.get("history_updated_at")
+
+
+def cache_headers(etag: str, last_modified=None) -> dict:
+    # private: the content is per user; no-cache: revalidate on every view
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Weak comparison of If-None-Match against the current ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == current for tag in header.split(","))
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
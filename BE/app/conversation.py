@@ -0,0 +1,217 @@
+"""
+Conversation context assembly for chat completions
+
+Long conversations keep constant-size prompts through a rolling memory:
+once the turns that are not yet summarized exceed MEMORY_TRIGGER_TOKENS,
+a background task folds all but the last MEMORY_RECENT_MESSAGES of them
+into `memory_summary` on the history document. `memory_upto` and
+`memory_upto_id` mark the last folded message. The prompt is then the
+summary plus the raw turns after it.
+"""
+import asyncio
+import os
+from bson import ObjectId
+from app.database import message_collection, history_collection
+from app.llm import llm_client
+from app.retention import restore_history
+from app.singleflight import SingleFlight
+from app.utils import estimate_tokens
+
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "50"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "true").lower() in ("1", "true", "yes")
+MEMORY_TRIGGER_TOKENS = int(os.getenv("MEMORY_TRIGGER_TOKENS", "2000"))
+MEMORY_RECENT_MESSAGES = int(os.getenv("MEMORY_RECENT_MESSAGES", "6"))
+MEMORY_FOLD_MAX_TOKENS = int(os.getenv("MEMORY_FOLD_MAX_TOKENS", "6000"))  # new turns folded per LLM call
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "500"))
+MEMORY_SCAN_LIMIT = 500  # messages read per fold round
+
+CHAT_SYSTEM_PROMPT = "You are a helpful AI assistant that provides concise and accurate summaries of text. You can also engage in conversation and answer questions. When asked to summarize text, provide clear and informative summaries. Maintain context from previous messages in the conversation and respond naturally based on the conversation history."
+
+MEMORY_PROMPT = "You maintain the memory of a conversation between a user and an AI assistant. Update the running summary with the new messages. Keep facts, names, numbers, decisions, open questions and the user's preferences; drop small talk. Write it in third person as a compact summary, without any preamble."
+
+memory_flight = SingleFlight()
+_memory_tasks = set()
+
+
+def _after(timestamp, message_id) -> dict:
+    """Filter for messages strictly after (timestamp, _id)"""
+    return {
+        "timestamp": {"$gte": timestamp},
+        "$or": [{"timestamp": {"$gt": timestamp}}, {"_id": {"$gt": message_id}}],
+    }
+
+
+async def get_memory(history_id: str) -> dict:
+    """Memory fields and archived flag of a history, empty when there is none yet"""
+    if not ObjectId.is_valid(history_id):
+        return {}
+    projection = {"archived": 1}
+    if MEMORY_ENABLED:
+        projection.update({"memory_summary": 1, "memory_upto": 1, "memory_upto_id": 1})
+    doc = await history_collection.find_one({"_id": ObjectId(history_id)}, projection)
+    return doc or {}
+
+
+async def _read_recent(history_id: str, exclude_id=None) -> list:
+    """Newest CONTEXT_MAX_MESSAGES messages of a history, newest first, through the (history_id, timestamp) index"""
+    query = {"history_id": history_id}
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    return await message_collection.find(
+        query,
+        {"role": 1, "content": 1, "timestamp": 1}
+    ).sort([("timestamp", -1), ("_id", -1)]).limit(CONTEXT_MAX_MESSAGES).to_list(length=CONTEXT_MAX_MESSAGES)
+
+
+def _select_context(newest_first: list, max_tokens: int, memory: dict = None) -> tuple:
+    """Return (messages oldest first, unsummarized_tokens) for the prompt.
+
+    Messages already folded into the memory summary are skipped.
+    unsummarized_tokens is None when the messages after the summary did
+    not all fit.
+    """
+    upto = (memory or {}).get("memory_upto_id") and (memory["memory_upto"], memory["memory_upto_id"])
+    selected = []
+    budget = max_tokens
+    complete = len(newest_first) < CONTEXT_MAX_MESSAGES
+    for msg in newest_first:
+        if upto and (msg["timestamp"], msg["_id"]) <= upto:
+            complete = True
+            break
+        tokens = estimate_tokens(msg["content"])
+        if tokens > budget:
+            complete = False
+            break
+        budget -= tokens
+        selected.append(msg)
+    selected.reverse()
+    return selected, (max_tokens - budget if complete else None)
+
+
+async def build_conversation(history_id, current_message: dict) -> list:
+    """Build the chat prompt from the memory summary, the recent messages and the current one.
+
+    history_id is None for a conversation that has no previous messages.
+    """
+    memory = {}
+    previous_messages = []
+    if history_id is not None:
+        memory, recent = await asyncio.gather(
+            get_memory(history_id),
+            _read_recent(history_id, current_message.get("_id"))
+        )
+        if memory.get("archived") and await restore_history(history_id):
+            recent = await _read_recent(history_id, current_message.get("_id"))
+        summary = memory.get("memory_summary") or ""
+        budget = CONTEXT_MAX_TOKENS - estimate_tokens(current_message["content"]) - estimate_tokens(summary)
+        previous_messages, unsummarized = _select_context(recent, max(budget, 0), memory)
+        if unsummarized is None or unsummarized > MEMORY_TRIGGER_TOKENS:
+            schedule_memory_update(history_id)
+
+    # Start with system message, then the memory summary, previous messages and the current user message
+    conversation_messages = [{
+        "role": "system",
+        "content": CHAT_SYSTEM_PROMPT
+    }]
+    if memory.get("memory_summary"):
+        conversation_messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{memory['memory_summary']}"
+        })
+    for prev_msg in previous_messages:
+        conversation_messages.append({
+            "role": prev_msg["role"],
+            "content": prev_msg["content"]
+        })
+    conversation_messages.append({
+        "role": "user",
+        "content": current_message["content"]
+    })
+    return conversation_messages
+
+
+def schedule_memory_update(history_id: str):
+    """Fold older turns into the memory summary in the background, once per history at a time"""
+    if not MEMORY_ENABLED or llm_client is None:
+        return
+    task = asyncio.create_task(memory_flight.do(history_id, lambda: update_memory(history_id)))
+    _memory_tasks.add(task)
+    task.add_done_callback(_memory_done)
+
+
+def _memory_done(task: asyncio.Task):
+    _memory_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        print(f"Conversation memory update failed: {task.exception()}")
+
+
+async def drain_memory_updates(timeout: float = None):
+    """Wait for running memory updates on shutdown, cancelling those past timeout"""
+    if not _memory_tasks:
+        return
+    _, pending = await asyncio.wait(set(_memory_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+def build_memory_messages(summary: str, messages: list) -> list:
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    return [
+        {"role": "system", "content": MEMORY_PROMPT},
+        {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+    ]
+
+
+async def update_memory(history_id: str, max_rounds: int = 5):
+    """Fold unsummarized turns, except the last MEMORY_RECENT_MESSAGES, into the memory summary.
+
+    Folding starts once those older turns exceed MEMORY_TRIGGER_TOKENS, so
+    a prompt holds at most the summary, that many tokens of older turns
+    and the recent messages.
+
+    The update only applies if memory_upto_id is unchanged, so concurrent
+    updates from several workers cannot overwrite each other.
+    """
+    for _ in range(max_rounds):
+        memory = await get_memory(history_id)
+        if not memory:
+            return
+        query = {"history_id": history_id}
+        if memory.get("memory_upto_id"):
+            query.update(_after(memory["memory_upto"], memory["memory_upto_id"]))
+        pending = await message_collection.find(
+            query,
+            {"role": 1, "content": 1, "timestamp": 1}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(MEMORY_SCAN_LIMIT).to_list(length=MEMORY_SCAN_LIMIT)
+
+        # With a full scan the recent messages lie beyond it, so everything read can be folded
+        if len(pending) < MEMORY_SCAN_LIMIT:
+            pending = pending[:max(len(pending) - MEMORY_RECENT_MESSAGES, 0)]
+        if sum(estimate_tokens(msg["content"]) for msg in pending) <= MEMORY_TRIGGER_TOKENS:
+            return
+
+        # Bound each summarization call; remaining turns are folded in the next round
+        batch, tokens = [], 0
+        for msg in pending:
+            tokens += estimate_tokens(msg["content"])
+            if batch and tokens > MEMORY_FOLD_MAX_TOKENS:
+                break
+            batch.append(msg)
+
+        summary = await llm_client.complete(
+            build_memory_messages(memory.get("memory_summary"), batch),
+            temperature=0.3,
+            max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+        )
+        result = await history_collection.update_one(
+            {"_id": memory["_id"], "memory_upto_id": memory.get("memory_upto_id")},
+            {"$set": {
+                "memory_summary": summary,
+                "memory_upto": batch[-1]["timestamp"],
+                "memory_upto_id": batch[-1]["_id"],
+            }}
+        )
+        if not result.modified_count:
+            return  # another worker updated the memory first
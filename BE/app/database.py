@@ -1,15 +1,35 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
+from app.metrics import CommandMetrics
 
 load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "text_summarizer")
 
-client = AsyncIOMotorClient(MONGODB_URL)
+# Connection pool of each worker process; serve.py splits MONGO_MAX_CONNECTIONS between workers
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))  # kept open so bursts skip the handshake
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+client = AsyncIOMotorClient(
+    MONGODB_URL,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE),
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[CommandMetrics()]
+)
 database = client[DATABASE_NAME]
 
 user_collection = database.get_collection("users")
 message_collection = database.get_collection("messages")
 history_collection = database.get_collection("history")
+summary_cache_collection = database.get_collection("summary_cache")
+jobs_collection = database.get_collection("jobs")
+rate_limit_collection = database.get_collection("rate_limits")
+revoked_token_collection = database.get_collection("revoked_tokens")
+history_archive_collection = database.get_collection("history_archive")
+lease_collection = database.get_collection("leases")
@@ -0,0 +1,102 @@
+"""
+Local extractive summarizer: TF-IDF sentence scoring plus TextRank
+
+Runs in-process with NumPy only, so it keeps working when the LLM provider
+is missing, failing or saturated.
+"""
+import os
+import re
+import numpy as np
+
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "8"))
+EXTRACTIVE_RATIO = float(os.getenv("EXTRACTIVE_RATIO", "0.2"))
+EXTRACTIVE_MAX_TERMS = int(os.getenv("EXTRACTIVE_MAX_TERMS", "2048"))
+EXTRACTIVE_MAX_CANDIDATES = int(os.getenv("EXTRACTIVE_MAX_CANDIDATES", "300"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"[a-z0-9']{2,}")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she should
+so some such than that the their theirs them themselves then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your
+yours yourself yourselves also may might must shall us it's don't i'm
+""".split())
+
+
+def split_sentences(text: str) -> list:
+    sentences = (s.strip() for s in _SENTENCE_RE.split(text))
+    return [s for s in sentences if s]
+
+
+def _tfidf(sentences: list):
+    """Return (row-normalized TF-IDF matrix, per-sentence TF-IDF score)"""
+    tokenized = [[w for w in _WORD_RE.findall(s.lower()) if w not in STOPWORDS] for s in sentences]
+    lengths = np.fromiter((len(t) for t in tokenized), dtype=np.int64, count=len(tokenized))
+    n = len(sentences)
+    if not lengths.sum():
+        return np.zeros((n, 1), dtype=np.float32), np.zeros(n, dtype=np.float32)
+
+    vocab, term_ids = np.unique(
+        np.array([w for t in tokenized for w in t]), return_inverse=True
+    )
+    sentence_ids = np.repeat(np.arange(n), lengths)
+
+    # Document frequency, keeping only the most common terms as features
+    pairs = np.unique(sentence_ids * len(vocab) + term_ids)
+    df = np.bincount(pairs % len(vocab), minlength=len(vocab))
+    keep = np.argsort(-df, kind="stable")[:EXTRACTIVE_MAX_TERMS]
+    remap = np.full(len(vocab), -1)
+    remap[keep] = np.arange(len(keep))
+    features = remap[term_ids]
+    mask = features >= 0
+    k = len(keep)
+
+    counts = np.bincount(
+        sentence_ids[mask] * k + features[mask], minlength=n * k
+    ).reshape(n, k).astype(np.float32)
+    idf = (np.log((1 + n) / (1 + df[keep])) + 1).astype(np.float32)
+    weights = counts * idf
+
+    scores = weights.sum(axis=1) / np.maximum(lengths, 1)
+    norms = np.linalg.norm(weights, axis=1, keepdims=True)
+    return weights / np.maximum(norms, 1e-9), scores
+
+
+def _textrank(matrix: np.ndarray, damping: float = 0.85, iterations: int = 50, tol: float = 1e-6) -> np.ndarray:
+    """PageRank over the cosine-similarity graph of the sentences"""
+    n = matrix.shape[0]
+    similarity = matrix @ matrix.T
+    np.fill_diagonal(similarity, 0.0)
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    # Sentences with no overlap link uniformly so the walk stays stochastic
+    transition = np.where(row_sums > 0, similarity / np.maximum(row_sums, 1e-9), 1.0 / n)
+    rank = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(iterations):
+        updated = (1 - damping) / n + damping * (transition.T @ rank)
+        if np.abs(updated - rank).sum() < tol:
+            return updated
+        rank = updated
+    return rank
+
+
+def extractive_summary(text: str, max_sentences: int = None) -> str:
+    """Pick the most central sentences of text and return them in document order"""
+    sentences = split_sentences(text)
+    if not sentences:
+        return ""
+    if max_sentences is None:
+        max_sentences = max(1, min(EXTRACTIVE_MAX_SENTENCES, round(len(sentences) * EXTRACTIVE_RATIO)))
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+
+    matrix, scores = _tfidf(sentences)
+
+    # TextRank only over the best TF-IDF candidates keeps the graph small
+    candidates = np.argsort(-scores, kind="stable")[:EXTRACTIVE_MAX_CANDIDATES]
+    rank = _textrank(matrix[candidates])
+    top = np.sort(candidates[np.argsort(-rank, kind="stable")[:max_sentences]])
+    return " ".join(sentences[i] for i in top)
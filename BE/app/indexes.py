@@ -0,0 +1,154 @@
+"""
+Index bootstrap and query-plan verification
+
+Run `python -m app.indexes` to create the indexes and fail if any hot
+route query is answered by a collection scan.
+"""
+import asyncio
+import sys
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+from app.database import (
+    user_collection,
+    message_collection,
+    history_collection,
+    jobs_collection,
+    rate_limit_collection,
+    revoked_token_collection,
+    history_archive_collection
+)
+from app.cache import summary_cache
+from app.conversation import CONTEXT_MAX_MESSAGES
+from app.pagination import encode_cursor, keyset_filter
+
+# Indexes matching the access patterns of the routes
+INDEXES = [
+    (user_collection, [
+        # Partial: legacy users without a username (or email) would all index as null and collide
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True,
+                   partialFilterExpression={"email": {"$type": "string"}}),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True,
+                   partialFilterExpression={"username": {"$type": "string"}}),
+    ]),
+    (message_collection, [
+        IndexModel([("history_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)],
+                   name="history_id_timestamp_id"),
+        # Message search; the user_id prefix limits a search to that user's entries
+        IndexModel([("user_id", ASCENDING), ("content", TEXT)], name="user_id_content_text",
+                   default_language="english"),
+    ]),
+    (history_collection, [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_id_created_at_id"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),  # retention sweep
+    ]),
+    (jobs_collection, [
+        IndexModel([("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+                   name="status_priority_created_at"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ]),
+    (rate_limit_collection, [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ]),
+    (history_archive_collection, [
+        # Lets message search find matching archived conversations
+        IndexModel([("user_id", ASCENDING), ("messages.content", TEXT)], name="user_id_messages_content_text",
+                   default_language="english"),
+    ]),
+    (revoked_token_collection, [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ]),
+]
+
+
+def _route_queries():
+    """(name, cursor) pairs mirroring the queries issued by the routes"""
+    sample_id = str(ObjectId())
+    sample_cursor = encode_cursor(datetime.utcnow(), ObjectId())
+    return [
+        ("auth.register/login email", user_collection.find({"email": "user@example.com"}).limit(1)),
+        ("auth.register username", user_collection.find({"username": "user"}).limit(1)),
+        ("messages.create_message context", message_collection.find(
+            {"history_id": sample_id, "_id": {"$ne": ObjectId()}}, {"role": 1, "content": 1, "timestamp": 1}
+        ).sort([("timestamp", -1), ("_id", -1)]).limit(CONTEXT_MAX_MESSAGES)),
+        ("messages.get_messages_by_history", message_collection.find(
+            {"history_id": sample_id}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(101)),
+        ("messages.get_messages_by_history page", message_collection.find(
+            {"history_id": sample_id, **keyset_filter("timestamp", sample_cursor, 1)}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(101)),
+        ("messages.get_messages", message_collection.find({"history_id": {"$in": [sample_id]}}).sort("timestamp", 1).limit(50)),
+        ("messages.search", message_collection.find(
+            {"user_id": sample_id, "$text": {"$search": "summary"}}, {"score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), ("timestamp", -1)]).limit(21)),
+        ("history.get_chat_history", history_collection.find(
+            {"user_id": sample_id}
+        ).sort([("created_at", -1), ("_id", -1)]).limit(21)),
+        ("history.get_chat_history page", history_collection.find(
+            {"user_id": sample_id, **keyset_filter("created_at", sample_cursor, -1)}
+        ).sort([("created_at", -1), ("_id", -1)]).limit(21)),
+        ("history.export messages", message_collection.find(
+            {"history_id": {"$in": [sample_id, str(ObjectId())]}}
+        ).sort([("history_id", 1), ("timestamp", 1), ("_id", 1)])),
+        ("retention.sweep", history_collection.find(
+            {"updated_at": {"$lt": datetime.utcnow()}}, {"_id": 1}
+        ).limit(500)),
+        ("jobs.claim_job", jobs_collection.find(
+            {"status": {"$in": ["queued", "running"]}, "visible_at": {"$lte": datetime.utcnow()}}
+        ).sort([("priority", -1), ("created_at", 1)]).limit(1)),
+    ]
+
+
+async def ensure_indexes():
+    """Create all indexes; existing ones are left untouched"""
+    async def create(collection, model):
+        try:
+            await collection.create_indexes([model])
+        except OperationFailure as e:
+            # e.g. duplicate emails in old data block a unique index
+            print(f"Could not create index {model.document['name']} on {collection.name}: {e}")
+
+    # One index per call so a failing build cannot abort the others, all in parallel to keep startup short
+    await asyncio.gather(
+        *(create(collection, model) for collection, models in INDEXES for model in models),
+        summary_cache.ensure_indexes()
+    )
+
+
+def _plan_stages(plan) -> list:
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def explain_queries() -> list:
+    """Return (name, stages) for the winning plan of every route query"""
+    results = []
+    for name, cursor in _route_queries():
+        explanation = await cursor.explain()
+        results.append((name, _plan_stages(explanation["queryPlanner"]["winningPlan"])))
+    return results
+
+
+async def main() -> int:
+    await ensure_indexes()
+    failed = False
+    for name, stages in await explain_queries():
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        failed = failed or status == "COLLSCAN"
+        print(f"{status:8} {name}: {' > '.join(stages)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,242 @@
+"""
+Background job queue for long-running summarizations and maintenance work
+
+Jobs live in the `jobs` collection. Workers claim the highest-priority
+visible job with an atomic find_one_and_update that hides it for
+JOB_VISIBILITY_TIMEOUT seconds; a job whose worker dies becomes visible
+again and is retried until JOB_MAX_ATTEMPTS is reached.
+
+Each job `type` is run by the handler registered with @job_handler.
+Workers run inside the API process (JOB_WORKERS > 0) or separately with
+`python -m app.jobs`.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.database import jobs_collection
+from app.summarizer import summarize
+from app.utils import mongo_now
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))  # seconds
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))  # seconds, doubled per attempt
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))  # seconds
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "604800"))  # seconds finished jobs are kept
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+_workers = []
+_stop = asyncio.Event()
+
+# job type -> (handler, description used in error messages)
+JOB_HANDLERS = {}
+
+
+def job_handler(job_type: str, description: str):
+    """Register an async handler(payload) -> result for a job type"""
+    def register(fn):
+        JOB_HANDLERS[job_type] = (fn, description)
+        return fn
+    return register
+
+
+def job_helper(job) -> dict:
+    return {
+        "_id": str(job["_id"]),
+        "status": job.get("status", ""),
+        "priority": job.get("priority", 0),
+        "attempts": job.get("attempts", 0),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+    }
+
+
+async def enqueue_job(user_id: str, job_type: str, payload: dict, priority: int = 0) -> dict:
+    """Queue a job of a registered type and return its document"""
+    now = mongo_now()
+    job = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "type": job_type,
+        "payload": payload,
+        "status": QUEUED,
+        "priority": priority,
+        "attempts": 0,
+        "visible_at": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+    await jobs_collection.insert_one(job)
+    return job
+
+
+async def submit_job(user_id: str, text: str, bypass_cache: bool = False, mode: str = "auto",
+                     priority: int = 0) -> dict:
+    """Queue a summarization job and return its document"""
+    return await enqueue_job(
+        user_id, "summarize", {"text": text, "bypass_cache": bypass_cache, "mode": mode}, priority
+    )
+
+
+async def get_job(job_id: str, user_id: str):
+    """Fetch a job owned by user_id without its payload"""
+    return await jobs_collection.find_one(
+        {"_id": ObjectId(job_id), "user_id": user_id},
+        {"payload": 0}
+    )
+
+
+async def wait_for_job(job_id: str, user_id: str, timeout: float):
+    """Long-poll until the job finishes or the timeout expires"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await get_job(job_id, user_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        if asyncio.get_running_loop().time() >= deadline:
+            return job
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+async def claim_job():
+    """Atomically take the next visible job, hiding it from other workers"""
+    now = datetime.utcnow()
+    return await jobs_collection.find_one_and_update(
+        {"status": {"$in": [QUEUED, RUNNING]}, "visible_at": {"$lte": now}},
+        {
+            "$set": {
+                "status": RUNNING,
+                "visible_at": now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("priority", -1), ("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _finish(job: dict, update: dict):
+    # Matching on attempts fences out a worker whose lease already expired
+    now = datetime.utcnow()
+    update.setdefault("updated_at", now)
+    if update.get("status") in FINISHED:
+        update["expires_at"] = now + timedelta(seconds=JOB_RETENTION)
+    await jobs_collection.update_one(
+        {"_id": job["_id"], "attempts": job["attempts"]},
+        {"$set": update}
+    )
+
+
+@job_handler("summarize", "generating summary")
+async def run_summarize(payload: dict) -> dict:
+    text = payload["text"]
+    summary, _, mode = await summarize(text, payload.get("bypass_cache", False), payload.get("mode", "auto"))
+    return {
+        "summary": summary,
+        "original_length": len(text),
+        "summary_length": len(summary),
+        "mode": mode,
+    }
+
+
+async def process_job(job: dict):
+    """Run one claimed job and record its outcome"""
+    handler, description = JOB_HANDLERS.get(job.get("type", "summarize"), (None, "running job"))
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job type {job.get('type')!r}")
+        result = await handler(job["payload"])
+    except Exception as e:
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            await _finish(job, {"status": FAILED, "error": f"Error {description}: {str(e)}"})
+        else:
+            delay = JOB_RETRY_DELAY * (2 ** (job["attempts"] - 1))
+            await _finish(job, {
+                "status": QUEUED,
+                "error": str(e),
+                "visible_at": datetime.utcnow() + timedelta(seconds=delay),
+            })
+        return
+    await _finish(job, {
+        "status": SUCCEEDED,
+        "error": None,
+        "result": result,
+    })
+
+
+async def worker(stop: asyncio.Event):
+    """Claim and process jobs until stop is set"""
+    while not stop.is_set():
+        try:
+            job = await claim_job()
+        except Exception as e:
+            print(f"Job worker could not claim a job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            # Lease expired on the last attempt, e.g. the worker crashed
+            await _finish(job, {"status": FAILED, "error": "Job exceeded its maximum attempts"})
+            continue
+        await process_job(job)
+
+
+def start_workers(count: int = JOB_WORKERS):
+    """Start in-process worker tasks on the running loop"""
+    _stop.clear()
+    for _ in range(count):
+        _workers.append(asyncio.create_task(worker(_stop)))
+
+
+async def stop_workers(timeout: float = None):
+    """Let workers finish their current job, then stop them.
+
+    Workers still busy after timeout seconds are cancelled; their jobs are
+    picked up again once the lease expires.
+    """
+    _stop.set()
+    if _workers:
+        _, pending = await asyncio.wait(_workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def queue_depth() -> int:
+    """Number of jobs waiting to run"""
+    return await jobs_collection.count_documents({"status": QUEUED})
+
+
+async def main():
+    from app.indexes import ensure_indexes
+    import app.retention  # registers the purge handler
+    await ensure_indexes()
+    count = max(JOB_WORKERS, 1)
+    print(f"Running {count} job workers")
+    start_workers(count)
+    try:
+        await asyncio.gather(*_workers)
+    finally:
+        await stop_workers()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,535 @@
+"""
+Async LLM provider layer shared by the summarize and messages routes
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import httpx
+from dotenv import load_dotenv
+from app.metrics import LLM_REQUEST_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS, record_timing
+from app.utils import estimate_tokens
+
+load_dotenv()
+
+# Provider configuration
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq")  # "groq" or "fake"
+LLM_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "64"))  # waiting calls before the provider counts as saturated
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_WARMUP = os.getenv("LLM_WARMUP", "true").lower() in ("1", "true", "yes")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_TOKEN_RATE = float(os.getenv("FAKE_LLM_TOKEN_RATE", "200"))  # tokens per second
+
+# Multi-backend routing, enabled by LLM_BACKENDS (a JSON list, see README)
+LLM_BACKENDS = os.getenv("LLM_BACKENDS")
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "2.0"))  # seconds, until enough latencies are known
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.05"))
+LLM_MAX_HEDGES = int(os.getenv("LLM_MAX_HEDGES", "1"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # consecutive failures that open the circuit
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # seconds before a trial call
+LLM_LATENCY_WINDOW = 200
+LLM_LATENCY_MIN_SAMPLES = 20
+
+
+class LLMError(Exception):
+    """Raised when a provider call fails after all retries"""
+
+
+class LLMUnavailable(LLMError):
+    """Raised when no provider is configured"""
+
+
+class LLMProvider:
+    """Base provider with a concurrency cap and retry/backoff around each call"""
+    name = "base"
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def _slot(self):
+        """Hold one of the max_concurrency call slots"""
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def is_saturated(self) -> bool:
+        """Whether more than LLM_QUEUE_LIMIT calls are waiting for a slot"""
+        return self.waiting >= LLM_QUEUE_LIMIT
+
+    def _observe(self, model: str, seconds: float, outcome: str):
+        LLM_REQUEST_DURATION.observe(seconds, provider=self.name, model=model, outcome=outcome)
+        record_timing("llm", seconds)
+
+    def _record_tokens(self, model: str, tokens_in: int, tokens_out: int):
+        LLM_TOKENS.inc(tokens_in, provider=self.name, model=model, direction="in")
+        LLM_TOKENS.inc(tokens_out, provider=self.name, model=model, direction="out")
+
+    def _estimate_tokens(self, model: str, messages: list, output: str):
+        """Record ~4 characters per token when the backend reports no usage"""
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        self._record_tokens(model, prompt_chars // 4, len(output) // 4)
+
+    async def complete(self, messages: list, model: str = None, temperature: float = 0.7,
+                       max_tokens: int = 500) -> str:
+        """Run a chat completion and return the stripped response text"""
+        model = model or LLM_MODEL
+        attempt = 0
+        while True:
+            try:
+                async with self._slot():
+                    start = time.perf_counter()
+                    outcome = "error"
+                    try:
+                        text = await self._complete(messages, model, temperature, max_tokens)
+                        outcome = "ok"
+                        return text
+                    finally:
+                        self._observe(model, time.perf_counter() - start, outcome)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise LLMError(str(e)) from e
+                # Exponential backoff with jitter, slot released while waiting
+                await asyncio.sleep(self.backoff_base * (2 ** attempt) * (0.5 + random.random()))
+                attempt += 1
+
+    async def stream(self, messages: list, model: str = None, temperature: float = 0.7,
+                     max_tokens: int = 500) -> AsyncIterator[str]:
+        """Yield response text deltas as they arrive from the model"""
+        model = model or LLM_MODEL
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with self._slot():
+                    start = time.perf_counter()
+                    outcome = "error"
+                    try:
+                        async for delta in self._stream(messages, model, temperature, max_tokens):
+                            if not started:
+                                started = True
+                                LLM_TIME_TO_FIRST_TOKEN.observe(
+                                    time.perf_counter() - start, provider=self.name, model=model
+                                )
+                            yield delta
+                        outcome = "ok"
+                    finally:
+                        self._observe(model, time.perf_counter() - start, outcome)
+                    return
+            except Exception as e:
+                # Once tokens were forwarded a retry would duplicate output
+                if started or attempt >= self.max_retries or not self._is_retryable(e):
+                    raise LLMError(str(e)) from e
+                await asyncio.sleep(self.backoff_base * (2 ** attempt) * (0.5 + random.random()))
+                attempt += 1
+
+    async def _complete(self, messages: list, model: str, temperature: float, max_tokens: int) -> str:
+        raise NotImplementedError
+
+    def _stream(self, messages: list, model: str, temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def _is_retryable(self, error: Exception) -> bool:
+        return False
+
+    async def warm_up(self):
+        """Open a pooled connection ahead of the first call"""
+
+    async def aclose(self):
+        """Release pooled connections"""
+
+
+class GroqProvider(LLMProvider):
+    """Groq chat completions over a pooled async HTTP client"""
+    name = "groq"
+
+    def __init__(self, api_key: str, base_url: str = None, timeout: float = LLM_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        import groq
+        self._errors = groq
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+        # Retries are handled here so the SDK must not retry on its own
+        self._client = groq.AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,  # None falls back to GROQ_BASE_URL, then api.groq.com
+            http_client=self._http_client,
+            timeout=timeout,
+            max_retries=0
+        )
+
+    async def _complete(self, messages, model, temperature, max_tokens):
+        chat_completion = await self._client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        text = chat_completion.choices[0].message.content.strip()
+        usage = chat_completion.usage
+        if usage:
+            self._record_tokens(model, usage.prompt_tokens, usage.completion_tokens)
+        else:
+            self._estimate_tokens(model, messages, text)
+        return text
+
+    async def _stream(self, messages, model, temperature, max_tokens):
+        stream = await self._client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+        )
+        output = []
+        usage = None
+        try:
+            async with stream:
+                async for chunk in stream:
+                    # Groq reports usage on the final chunk
+                    x_groq = getattr(chunk, "x_groq", None)
+                    if x_groq is not None and getattr(x_groq, "usage", None):
+                        usage = x_groq.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        output.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+        finally:
+            if usage:
+                self._record_tokens(model, usage.prompt_tokens, usage.completion_tokens)
+            else:
+                self._estimate_tokens(model, messages, "".join(output))
+
+    def _is_retryable(self, error):
+        return isinstance(error, (
+            self._errors.APIConnectionError,  # includes timeouts
+            self._errors.RateLimitError,
+            self._errors.InternalServerError,
+        ))
+
+    async def warm_up(self):
+        # Any response leaves a TLS connection in the pool; no tokens are spent
+        try:
+            await self._http_client.get(str(self._client.base_url), timeout=5.0)
+        except httpx.HTTPError as e:
+            print(f"LLM warm-up failed for {self.name}: {e}")
+
+    async def aclose(self):
+        await self._http_client.aclose()
+
+
+class FakeProvider(LLMProvider):
+    """Offline provider for load testing: echoes the start of the prompt at a fixed latency and token rate"""
+    name = "fake"
+
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, token_rate: float = FAKE_LLM_TOKEN_RATE,
+                 failure_rate: float = 0.0, tail_rate: float = 0.0, tail_latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.failure_rate = failure_rate  # share of calls that fail
+        self.tail_rate = tail_rate  # share of calls that take tail_latency instead of latency
+        self.tail_latency = tail_latency
+
+    async def _wait_first_token(self):
+        slow = random.random() < self.tail_rate
+        await asyncio.sleep(self.tail_latency if slow else self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("Simulated provider failure")
+
+    def _tokens(self, messages, model, max_tokens):
+        prompt = messages[-1]["content"] if messages else ""
+        words = prompt.split()[:max(1, max_tokens // 4)]
+        return [f"[fake:{model}]"] + words
+
+    async def _complete(self, messages, model, temperature, max_tokens):
+        tokens = self._tokens(messages, model, max_tokens)
+        await self._wait_first_token()
+        await asyncio.sleep(len(tokens) / self.token_rate)
+        text = " ".join(tokens)
+        self._estimate_tokens(model, messages, text)
+        return text
+
+    async def _stream(self, messages, model, temperature, max_tokens):
+        await self._wait_first_token()
+        tokens = self._tokens(messages, model, max_tokens)
+        for i, token in enumerate(tokens):
+            yield token if i == 0 else " " + token
+            await asyncio.sleep(1 / self.token_rate)
+        self._estimate_tokens(model, messages, " ".join(tokens))
+
+
+class Backend:
+    """One routed provider and model with its recent latencies and a circuit breaker"""
+
+    def __init__(self, provider: LLMProvider, model: str, max_input_tokens: int = None):
+        self.provider = provider
+        self.name = provider.name
+        self.model = model
+        self.max_input_tokens = max_input_tokens  # only inputs up to this size are routed here
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.first_token_latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+    def is_available(self) -> bool:
+        """Closed circuit, or open past its cooldown with no trial call running"""
+        if self.failures < LLM_BREAKER_FAILURES:
+            return True
+        return not self.probing and time.monotonic() >= self.open_until
+
+    def begin(self):
+        if self.failures >= LLM_BREAKER_FAILURES:
+            self.probing = True  # half-open: this call decides
+
+    def succeeded(self):
+        self.failures = 0
+        self.probing = False
+
+    def failed(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= LLM_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + LLM_BREAKER_COOLDOWN
+
+    def abandoned(self):
+        """The call was cancelled because another backend answered first"""
+        self.probing = False
+
+    @staticmethod
+    def hedge_delay(samples: deque) -> float:
+        """Seconds to wait for this backend before hedging: its LLM_HEDGE_PERCENTILE latency"""
+        if len(samples) < LLM_LATENCY_MIN_SAMPLES:
+            return LLM_HEDGE_DELAY
+        ordered = sorted(samples)
+        rank = max(0, math.ceil(LLM_HEDGE_PERCENTILE / 100 * len(ordered)) - 1)
+        return max(ordered[rank], LLM_HEDGE_MIN_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "available": self.is_available(),
+            "failures": self.failures,
+            "hedge_delay": self.hedge_delay(self.latencies),
+        }
+
+
+async def _first_delta(stream: AsyncIterator[str]):
+    return await anext(stream, None)
+
+
+class LLMRouter:
+    """Routes calls over several backends with failover, hedging and circuit breaking.
+
+    Backends that accept the input size are tried smallest max_input_tokens
+    first, so short inputs go to cheaper models. If the chosen backend has
+    not answered within its LLM_HEDGE_PERCENTILE latency, the next one is
+    started as well and the first answer wins; the other call is cancelled.
+    Streams hedge on the time to the first token.
+    """
+    name = "router"
+
+    def __init__(self, backends: list):
+        self.backends = backends
+
+    @property
+    def in_flight(self) -> int:
+        return sum(backend.provider.in_flight for backend in self.backends)
+
+    @property
+    def waiting(self) -> int:
+        return sum(backend.provider.waiting for backend in self.backends)
+
+    def is_saturated(self) -> bool:
+        """Whether every available backend is saturated"""
+        return all(b.provider.is_saturated() for b in self.backends if b.is_available())
+
+    def _candidates(self, messages: list) -> list:
+        tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        eligible = [
+            b for b in self.backends
+            if b.is_available() and (b.max_input_tokens is None or tokens <= b.max_input_tokens)
+        ]
+        if not eligible:
+            raise LLMError("No healthy LLM backend for this request")
+        # Unsaturated first, then the smallest model that takes the input; config order breaks ties
+        return sorted(eligible, key=lambda b: (
+            b.provider.is_saturated(), b.max_input_tokens is None, b.max_input_tokens or 0
+        ))
+
+    async def _race(self, candidates: list, start_call, samples_of) -> tuple:
+        """Run start_call on candidates with hedging and failover; return (backend, result) of the first success"""
+        pending = {}
+        errors = []
+        next_index = 0
+        hedges = 0
+
+        def launch():
+            nonlocal next_index
+            backend = candidates[next_index]
+            next_index += 1
+            backend.begin()
+            pending[asyncio.create_task(start_call(backend))] = (backend, time.monotonic())
+
+        launch()
+        try:
+            while pending:
+                latest, _ = list(pending.values())[-1]
+                can_hedge = LLM_HEDGE_ENABLED and hedges < LLM_MAX_HEDGES and next_index < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=Backend.hedge_delay(samples_of(latest)) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    backend, started = pending.pop(task)
+                    if task.exception() is None:
+                        backend.succeeded()
+                        samples_of(backend).append(time.monotonic() - started)
+                        return backend, task.result()
+                    backend.failed()
+                    errors.append(f"{backend.name}: {task.exception()}")
+                if not pending and next_index < len(candidates):
+                    launch()  # fail over
+            raise LLMError("All LLM backends failed: " + "; ".join(errors))
+        finally:
+            for task, (backend, started) in pending.items():
+                task.cancel()
+                backend.abandoned()
+                # A lower bound, but dropping the losers would drag the percentile down
+                samples_of(backend).append(time.monotonic() - started)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def complete(self, messages: list, model: str = None, temperature: float = 0.7,
+                       max_tokens: int = 500) -> str:
+        """Run a chat completion on the best backend; model is chosen per backend"""
+        _, text = await self._race(
+            self._candidates(messages),
+            lambda b: b.provider.complete(messages, b.model, temperature, max_tokens),
+            lambda b: b.latencies
+        )
+        return text
+
+    async def stream(self, messages: list, model: str = None, temperature: float = 0.7,
+                     max_tokens: int = 500) -> AsyncIterator[str]:
+        """Yield response text deltas from the backend that produced the first token"""
+        streams = {}
+
+        async def start_stream(backend):
+            stream = backend.provider.stream(messages, backend.model, temperature, max_tokens)
+            streams[backend] = stream
+            return await _first_delta(stream)
+
+        try:
+            backend, first = await self._race(
+                self._candidates(messages), start_stream, lambda b: b.first_token_latencies
+            )
+        except BaseException:
+            for stream in streams.values():
+                await stream.aclose()
+            raise
+        for other, stream in streams.items():
+            if other is not backend:
+                await stream.aclose()
+
+        stream = streams[backend]
+        try:
+            if first is not None:
+                yield first
+                async for delta in stream:
+                    yield delta
+        except LLMError:
+            backend.failed()
+            raise
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> list:
+        return [backend.stats() for backend in self.backends]
+
+    async def warm_up(self):
+        await asyncio.gather(*(backend.provider.warm_up() for backend in self.backends))
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.provider.aclose()
+
+
+def _build_backend(config: dict) -> Backend:
+    kind = config.get("provider", "groq")
+    kwargs = {key: config[key] for key in ("max_concurrency", "max_retries", "backoff_base") if key in config}
+    if kind == "fake":
+        provider = FakeProvider(
+            latency=config.get("latency", FAKE_LLM_LATENCY),
+            token_rate=config.get("token_rate", FAKE_LLM_TOKEN_RATE),
+            failure_rate=config.get("failure_rate", 0.0),
+            tail_rate=config.get("tail_rate", 0.0),
+            tail_latency=config.get("tail_latency", 0.0),
+            **kwargs
+        )
+    elif kind == "groq":
+        api_key = config.get("api_key") or os.getenv(config.get("api_key_env", "GROQ_API_KEY"))
+        provider = GroqProvider(
+            api_key,
+            base_url=config.get("base_url"),
+            timeout=config.get("timeout", LLM_TIMEOUT),
+            **kwargs
+        )
+    else:
+        raise ValueError(f"Unknown LLM provider {kind!r}")
+    provider.name = config.get("name", kind)
+    return Backend(provider, config.get("model", LLM_MODEL), config.get("max_input_tokens"))
+
+
+def _build_provider():
+    if LLM_BACKENDS:
+        return LLMRouter([_build_backend(config) for config in json.loads(LLM_BACKENDS)])
+    if LLM_PROVIDER == "fake":
+        return FakeProvider()
+    if GROQ_API_KEY:
+        return GroqProvider(GROQ_API_KEY)
+    return None
+
+
+# Shared provider instance, None when no backend is configured
+llm_client = _build_provider()
+
+# Every model that may answer a request; the router picks one per call
+LLM_MODELS = sorted({b.model for b in llm_client.backends}) if isinstance(llm_client, LLMRouter) else [LLM_MODEL]
@@ -1,7 +1,11 @@
 """
 Main FastAPI application
 """
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import (
     authRoute,
@@ -9,17 +13,69 @@ from app.routes import (
     messagesRoute,
     summarizeRoute,
     historyRoute,
-    profileRoute
+    profileRoute,
+    metricsRoute
 )
 from app.database import client
+from app.llm import llm_client, LLM_WARMUP
+from app.indexes import ensure_indexes
+from app.jobs import start_workers, stop_workers
+from app.conversation import drain_memory_updates
+from app.retention import start_retention, stop_retention
+from app.ratelimit import ConcurrencyLimitMiddleware
+from app.metrics import MetricsMiddleware, start_metrics, stop_metrics
+from app.compression import CompressionMiddleware
+
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))  # seconds for background work to finish
+
+
+async def warm_up():
+    """Open the Mongo and LLM connection pools before the first request"""
+    tasks = [client.admin.command("ping")]
+    if ENSURE_INDEXES_ON_STARTUP:
+        tasks.append(ensure_indexes())
+    if llm_client and LLM_WARMUP:
+        tasks.append(llm_client.warm_up())
+    await asyncio.gather(*tasks)
+
+
+# Database connection lifecycle
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up on startup; on shutdown drain background work, then close the pools"""
+    await warm_up()
+    start_workers()
+    start_retention()
+    start_metrics()
+    print("Connected to MongoDB")
+    yield
+    # The server has stopped accepting requests and finished the open ones
+    await stop_retention()
+    await asyncio.gather(
+        stop_workers(SHUTDOWN_DRAIN_TIMEOUT),
+        drain_memory_updates(SHUTDOWN_DRAIN_TIMEOUT)
+    )
+    await stop_metrics()
+    if llm_client:
+        await llm_client.aclose()
+    if client:
+        client.close()
+        print("Disconnected from MongoDB")
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Text Summarizer API",
     version="1.0.0",
-    description="FastAPI backend for Text Summarizer with MongoDB integration"
+    description="FastAPI backend for Text Summarizer with MongoDB integration",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Global concurrency gate, added first so CORS headers wrap its 503 responses
+app.add_middleware(ConcurrencyLimitMiddleware)
+
 # CORS middleware
 
 app.add_middleware(
@@ -30,20 +86,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses; streamed token responses are exempt
+app.add_middleware(CompressionMiddleware)
 
-# Database connection lifecycle
-@app.on_event("startup")
-async def startup_db_client():
-    """Initialize database connection on startup"""
-    print("Connected to MongoDB")
-
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    """Close database connection on shutdown"""
-    if client:
-        client.close()
-        print("Disconnected from MongoDB")
+# Request metrics, outermost so shed and rejected requests are counted too
+app.add_middleware(MetricsMiddleware)
 
 
 # Include routers
@@ -53,6 +100,7 @@ app.include_router(messagesRoute.router)
 app.include_router(summarizeRoute.router)
 app.include_router(historyRoute.router)
 app.include_router(profileRoute.router)
+app.include_router(metricsRoute.router)
 
 
 # Root endpoint
@@ -0,0 +1,332 @@
+"""
+Prometheus metrics: request, MongoDB command and LLM call latency histograms plus counters and gauges
+
+Metrics are kept per worker process and rendered in the Prometheus text
+format by the /metrics route. When PROMETHEUS_MULTIPROC_DIR is set (serve.py
+sets it for several workers) every worker writes a snapshot of its metrics
+there every METRICS_FLUSH_INTERVAL seconds and /metrics merges all of them,
+so any worker answers a scrape with the totals of the whole server:
+counters and histograms are summed, gauges get a `worker` label.
+
+With SERVER_TIMING=true every response also carries a Server-Timing header
+with the time spent in MongoDB and the LLM.
+"""
+import asyncio
+import contextvars
+import copy
+import glob
+import json
+import os
+import threading
+import time
+from pymongo import monitoring
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+METRICS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))  # seconds between snapshots
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class for a labelled metric family"""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()  # MongoDB listeners run on executor threads
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._values)
+
+    def merge(self, total, value):
+        return (total or 0) + value
+
+    def samples(self, values: dict = None, labels: tuple = None) -> list:
+        values = self.snapshot() if values is None else values
+        labels = self.labels if labels is None else labels
+        return [(self.name, _format_labels(labels, key), value) for key, value in values.items()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, total, value):
+        if total is None:
+            return copy.deepcopy(value)
+        return [[a + b for a, b in zip(total[0], value[0])], total[1] + value[1], total[2] + value[2]]
+
+    def samples(self, values: dict = None, labels: tuple = None) -> list:
+        values = self.snapshot() if values is None else values
+        labels = self.labels if labels is None else labels
+        out = []
+        for key, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                out.append((f"{self.name}_bucket", _format_labels(labels, key, f'le="{bound}"'), cumulative))
+            out.append((f"{self.name}_bucket", _format_labels(labels, key, 'le="+Inf"'), count))
+            out.append((f"{self.name}_sum", _format_labels(labels, key), total))
+            out.append((f"{self.name}_count", _format_labels(labels, key), count))
+        return out
+
+
+class Registry:
+    """All metric families of this process plus collectors refreshed on each scrape"""
+
+    def __init__(self, multiproc_dir: str = METRICS_MULTIPROC_DIR):
+        self.metrics = []
+        self.collectors = []
+        self.multiproc_dir = multiproc_dir
+        self.worker = str(os.getpid())
+        # Unique per process lifetime so a recycled pid never overwrites a dead worker's counters
+        self.path = os.path.join(multiproc_dir, f"{os.getpid()}-{time.time_ns()}.json") if multiproc_dir else None
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """collector is an async callable that updates gauges before rendering"""
+        self.collectors.append(collector)
+
+    async def collect(self):
+        for collector in self.collectors:
+            await collector()
+
+    def write_snapshot(self, include_gauges: bool = True):
+        """Write this worker's metrics to its file in the shared directory"""
+        data = {"worker": self.worker, "metrics": {}}
+        for metric in self.metrics:
+            if metric.type == "gauge" and not include_gauges:
+                continue  # a stopped worker has nothing in progress
+            data["metrics"][metric.name] = [[list(key), value] for key, value in metric.snapshot().items()]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)  # readers never see a partial file
+
+    def _read_snapshots(self) -> list:
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiproc_dir, "*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                pass  # removed or replaced while reading
+        return snapshots
+
+    def _merged(self, metric: Metric, snapshots: list) -> tuple:
+        """(values, label names) of one metric across all worker snapshots"""
+        if metric.type == "gauge":
+            values = {
+                tuple(key) + (snapshot["worker"],): value
+                for snapshot in snapshots for key, value in snapshot["metrics"].get(metric.name, [])
+            }
+            return values, metric.labels + ("worker",)
+        values = {}
+        for snapshot in snapshots:
+            for key, value in snapshot["metrics"].get(metric.name, []):
+                values[tuple(key)] = metric.merge(values.get(tuple(key)), value)
+        return values, metric.labels
+
+    async def render(self) -> str:
+        await self.collect()
+        snapshots = None
+        if self.multiproc_dir:
+            self.write_snapshot()
+            snapshots = self._read_snapshots()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            samples = metric.samples(*self._merged(metric, snapshots)) if snapshots is not None else metric.samples()
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+_flusher = None
+_stop = asyncio.Event()
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status",
+    ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests currently being served by this worker"
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command",
+    ("collection", "command", "outcome")
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "LLM call latency by provider and model",
+    ("provider", "model", "outcome")
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time until the first streamed token",
+    ("provider", "model")
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "LLM tokens sent (in) and generated (out)",
+    ("provider", "model", "direction")
+)
+
+async def flusher(stop: asyncio.Event):
+    """Write this worker's snapshot every METRICS_FLUSH_INTERVAL seconds"""
+    while not stop.is_set():
+        try:
+            await REGISTRY.collect()
+            REGISTRY.write_snapshot()
+        except Exception as e:
+            print(f"Could not write metrics snapshot: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), METRICS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_metrics():
+    """Start writing snapshots on the running loop when metrics are shared between workers"""
+    global _flusher
+    _stop.clear()
+    if REGISTRY.multiproc_dir:
+        _flusher = asyncio.create_task(flusher(_stop))
+
+
+async def stop_metrics():
+    """Write a final snapshot; counters of a stopped worker keep counting towards the totals"""
+    global _flusher
+    _stop.set()
+    if _flusher is not None:
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+        REGISTRY.write_snapshot(include_gauges=False)
+
+
+# Per-request accumulated time by component, for the Server-Timing header
+_timings = contextvars.ContextVar("server_timings", default=None)
+
+
+def record_timing(component: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[component] = timings.get(component, 0.0) + seconds
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """pymongo listener timing every command Motor sends"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome: str):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.observe(seconds, collection=collection, command=event.command_name, outcome=outcome)
+        record_timing("db", seconds)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class MetricsMiddleware:
+    """Times every HTTP request by route template and status code"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = {}
+        token = _timings.set(timings)
+        status_code = 500
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if SERVER_TIMING:
+                    timings["total"] = time.perf_counter() - start
+                    header = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status_code
+            )
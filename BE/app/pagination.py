@@ -0,0 +1,74 @@
+"""
+Keyset (cursor) pagination over a (sort field, _id) pair
+"""
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, status
+
+
+def encode_cursor(value: datetime, doc_id) -> str:
+    """Opaque token for the position right after a document"""
+    raw = json.dumps([value.isoformat() if value else None, str(doc_id)])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of encode_cursor; raises 400 on a malformed token"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return (datetime.fromisoformat(value) if value else None), ObjectId(doc_id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+def keyset_filter(field: str, cursor: str, direction: int) -> dict:
+    """Filter selecting documents strictly after the cursor in (field, _id) order"""
+    value, doc_id = decode_cursor(cursor)
+    op, bound = ("$gt", "$gte") if direction == 1 else ("$lt", "$lte")
+    # The inclusive bound keeps the index scan tight; $or only resolves ties
+    return {
+        field: {bound: value},
+        "$or": [{field: {op: value}}, {"_id": {op: doc_id}}],
+    }
+
+
+async def fetch_page(collection, query: dict, field: str, direction: int, limit: int,
+                     cursor: str = None, projection: dict = None) -> tuple:
+    """Return (docs, next_cursor, has_more) for one page.
+
+    One extra document is fetched to compute has_more, so no count is needed
+    and the cost of a page does not depend on how deep it is.
+    """
+    if cursor:
+        query = {**query, **keyset_filter(field, cursor, direction)}
+    docs = await collection.find(query, projection).sort(
+        [(field, direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(length=limit + 1)
+    return _page(docs, field, limit)
+
+
+def merge_page(sources: list, field: str, direction: int, limit: int) -> tuple:
+    """Return (docs, next_cursor, has_more) for one page drawn from several
+    result lists, each sorted by (field, _id) and holding up to limit + 1 documents
+    """
+    def key(doc):
+        # Missing values sort first, as in MongoDB
+        value = doc.get(field)
+        return value is not None, value or 0, doc["_id"]
+
+    docs = sorted((doc for docs in sources for doc in docs), key=key, reverse=direction == -1)
+    return _page(docs, field, limit)
+
+
+def _page(docs: list, field: str, limit: int) -> tuple:
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(docs[-1].get(field), docs[-1]["_id"]) if has_more else None
+    return docs, next_cursor, has_more
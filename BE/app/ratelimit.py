@@ -0,0 +1,189 @@
+"""
+Per-user admission control, token-bucket rate limiting and load shedding
+
+Buckets live in process memory by default. With RATE_LIMIT_BACKEND=mongo
+they are kept in the `rate_limits` collection and updated atomically, so
+all workers share one budget per user.
+"""
+import math
+import os
+import time
+from collections import OrderedDict, defaultdict
+from fastapi import Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from app.auth import verify_token
+from app.database import rate_limit_collection
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" or "mongo"
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.getenv("RATE_LIMIT_REQUESTS_PER_MINUTE", "60"))
+RATE_LIMIT_REQUEST_BURST = float(os.getenv("RATE_LIMIT_REQUEST_BURST", "20"))
+RATE_LIMIT_TOKENS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TOKENS_PER_MINUTE", "200000"))
+RATE_LIMIT_TOKEN_BURST = float(os.getenv("RATE_LIMIT_TOKEN_BURST", "400000"))
+USER_MAX_CONCURRENT_REQUESTS = int(os.getenv("USER_MAX_CONCURRENT_REQUESTS", "8"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "1024"))
+RATE_LIMIT_MAX_KEYS = 100000
+
+
+class TokenBucket:
+    """Classic token bucket: holds up to capacity tokens, refilled at rate per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, amount: float) -> float:
+        """Take amount tokens; return 0 on success or the seconds to wait otherwise"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+
+class MemoryRateLimiter:
+    """Buckets in process memory, bounded to the most recently used keys"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, amount: float, capacity: float, rate: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(capacity, rate)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket.take(amount)
+
+    async def give(self, key: str, amount: float, capacity: float):
+        """Put unused tokens back, up to capacity"""
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(capacity, bucket.tokens + amount)
+
+
+class MongoRateLimiter:
+    """Buckets in MongoDB, refilled and debited in one atomic pipeline update"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key: str, amount: float, capacity: float, rate: float) -> float:
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": "$$NOW"}},
+                {"$set": {"allowed": {"$gte": ["$tokens", amount]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", amount]}, "$tokens"]},
+                    # Idle buckets are full again after capacity / rate seconds
+                    "expires_at": {"$add": ["$$NOW", int(capacity / rate * 1000) + 60000]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (amount - doc["tokens"]) / rate
+
+    async def give(self, key: str, amount: float, capacity: float):
+        await self.collection.update_one(
+            {"_id": key},
+            [{"$set": {"tokens": {"$min": [capacity, {"$add": ["$tokens", amount]}]}}}]
+        )
+
+
+limiter = MongoRateLimiter(rate_limit_collection) if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimiter()
+
+_active_requests = defaultdict(int)
+
+
+def _too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+async def rate_limited_user(token_data: dict = Depends(verify_token)) -> dict:
+    """verify_token plus the per-user request budget"""
+    retry_after = await limiter.take(
+        f"requests:{token_data['user_id']}", 1,
+        RATE_LIMIT_REQUEST_BURST, RATE_LIMIT_REQUESTS_PER_MINUTE / 60
+    )
+    if retry_after:
+        raise _too_many_requests("Rate limit exceeded", retry_after)
+    return token_data
+
+
+async def admit_user(token_data: dict = Depends(rate_limited_user)):
+    """rate_limited_user plus a cap on the user's concurrent requests in this worker"""
+    user_id = token_data["user_id"]
+    if _active_requests[user_id] >= USER_MAX_CONCURRENT_REQUESTS:
+        raise _too_many_requests("Too many concurrent requests", 1)
+    _active_requests[user_id] += 1
+    try:
+        yield token_data
+    finally:
+        _active_requests[user_id] -= 1
+        if not _active_requests[user_id]:
+            del _active_requests[user_id]
+
+
+async def charge_llm_tokens(user_id: str, tokens: int) -> float:
+    """Debit the user's LLM token budget or raise 429; return the amount debited"""
+    tokens = min(tokens, RATE_LIMIT_TOKEN_BURST)  # a single huge request must still be admissible
+    retry_after = await limiter.take(
+        f"llm_tokens:{user_id}", tokens,
+        RATE_LIMIT_TOKEN_BURST, RATE_LIMIT_TOKENS_PER_MINUTE / 60
+    )
+    if retry_after:
+        raise _too_many_requests("LLM token budget exceeded", retry_after)
+    return tokens
+
+
+async def refund_llm_tokens(user_id: str, tokens: float):
+    """Return the unused part of a reservation made with charge_llm_tokens"""
+    if tokens > 0:
+        await limiter.give(f"llm_tokens:{user_id}", tokens, RATE_LIMIT_TOKEN_BURST)
+
+
+class ConcurrencyLimitMiddleware:
+    """Global gate: shed load with 503 + Retry-After instead of queueing without bound"""
+
+    def __init__(self, app, limit: int = MAX_CONCURRENT_REQUESTS, retry_after: int = 1,
+                 exempt_paths: tuple = ("/metrics",)):
+        self.app = app
+        self.limit = limit
+        self.retry_after = retry_after
+        self.exempt_paths = exempt_paths
+        self.active = 0
+
+    async def __call__(self, scope, receive, send):
+        # Monitoring must keep working while the server sheds load
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        if self.active >= self.limit:
+            response = JSONResponse(
+                {"detail": "Server is overloaded, please retry later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        self.active += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.active -= 1
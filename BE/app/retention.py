@@ -0,0 +1,259 @@
+"""
+Conversation retention: cascade deletion, archival of cold conversations and expiry
+
+Deleting a history queues a `purge_history` job that removes its messages
+in batches. A periodic sweep moves conversations inactive for
+HISTORY_ARCHIVE_AFTER_DAYS into `history_archive`, one document per
+history, and deletes conversations inactive for HISTORY_RETENTION_DAYS.
+Only one worker runs the sweep at a time, guarded by a lease in the
+`leases` collection. Archived conversations are read straight from their
+archive document and restored only when they are continued.
+
+Run one sweep by hand with `python -m app.retention`.
+"""
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.database import (
+    history_collection,
+    message_collection,
+    history_archive_collection,
+    lease_collection
+)
+from app.jobs import enqueue_job, job_handler
+from app.conditional import bump_user_histories
+
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "0"))  # 0 keeps conversations forever
+HISTORY_ARCHIVE_AFTER_DAYS = float(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", "0"))  # 0 disables archival
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))  # seconds between sweeps
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "500"))  # histories handled per sweep and policy
+PURGE_BATCH = 1000  # messages deleted per round trip
+ARCHIVE_MAX_BYTES = 8 * 1024 * 1024  # larger conversations stay live, far below the 16 MB document limit
+
+_sweeper = None
+_stop = asyncio.Event()
+_owner = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def purge_messages(history_id: str) -> int:
+    """Delete all messages of a history in batches and its archive; return the number of messages deleted"""
+    deleted = 0
+    while True:
+        ids = [doc["_id"] for doc in await message_collection.find(
+            {"history_id": history_id}, {"_id": 1}
+        ).limit(PURGE_BATCH).to_list(length=PURGE_BATCH)]
+        if not ids:
+            break
+        result = await message_collection.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+    if ObjectId.is_valid(history_id):
+        await history_archive_collection.delete_one({"_id": ObjectId(history_id)})
+    return deleted
+
+
+@job_handler("purge_history", "deleting conversation")
+async def run_purge(payload: dict) -> dict:
+    return {"deleted_messages": await purge_messages(payload["history_id"])}
+
+
+async def schedule_purge(user_id: str, history_id: str):
+    """Delete a history's messages in the background through the job queue"""
+    await enqueue_job(user_id, "purge_history", {"history_id": history_id}, priority=1)
+
+
+async def archive_history(history: dict) -> bool:
+    """Move the messages of a history into one archive document; False if it was skipped"""
+    history_id = str(history["_id"])
+    # Measure on the server first: an oversized conversation is never loaded
+    size = await message_collection.aggregate([
+        {"$match": {"history_id": history_id}},
+        {"$group": {"_id": None, "bytes": {"$sum": {"$strLenBytes": {"$ifNull": ["$content", ""]}}}}}
+    ]).to_list(length=1)
+    if size and size[0]["bytes"] > ARCHIVE_MAX_BYTES:
+        # Left out of later sweeps, so it cannot fill every batch
+        await history_collection.update_one({"_id": history["_id"]}, {"$set": {"archive_skipped": True}})
+        return False
+
+    messages = await message_collection.find(
+        {"history_id": history_id},
+        {"history_id": 0}
+    ).sort([("timestamp", 1), ("_id", 1)]).to_list(length=None)
+
+    await history_archive_collection.replace_one(
+        {"_id": history["_id"]},
+        {
+            "user_id": history.get("user_id"),
+            "created_at": history.get("created_at"),
+            "updated_at": history.get("updated_at"),
+            "archived_at": datetime.utcnow(),
+            "messages": messages,
+        },
+        upsert=True
+    )
+    # Give up if the conversation was continued since it was selected
+    result = await history_collection.update_one(
+        {"_id": history["_id"], "updated_at": history.get("updated_at"), "archived": {"$ne": True}},
+        {"$set": {"archived": True}}
+    )
+    if not result.modified_count:
+        await history_archive_collection.delete_one({"_id": history["_id"]})
+        return False
+    # Messages added while archiving are not in the archive and stay live
+    await message_collection.delete_many({"_id": {"$in": [m["_id"] for m in messages]}})
+    return True
+
+
+async def archived_messages(match: dict, query: dict = None, sort: list = None, limit: int = 0) -> list:
+    """Messages of the archives selected by match, shaped like message documents.
+
+    query filters and sort orders them as on the messages collection; the
+    archive stays where it is.
+    """
+    pipeline = [
+        {"$match": match},
+        {"$unwind": "$messages"},
+        {"$project": {
+            "_id": "$messages._id",
+            "history_id": {"$toString": "$_id"},
+            "role": "$messages.role",
+            "content": "$messages.content",
+            "timestamp": "$messages.timestamp",
+        }},
+    ]
+    if query:
+        pipeline.append({"$match": query})
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    if limit:
+        pipeline.append({"$limit": limit})
+    return await history_archive_collection.aggregate(pipeline).to_list(length=None)
+
+
+async def restore_history(history_id: str) -> bool:
+    """Move an archived conversation back into the messages collection"""
+    if not ObjectId.is_valid(history_id):
+        return False
+    archive = await history_archive_collection.find_one({"_id": ObjectId(history_id)})
+    if archive is None:
+        return False
+    if archive["messages"]:
+        try:
+            await message_collection.insert_many(
+                [{**m, "history_id": history_id, "user_id": archive.get("user_id")} for m in archive["messages"]],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            # Another request restored some of them first
+            if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+    await history_collection.update_one(
+        {"_id": archive["_id"]},
+        {"$unset": {"archived": ""}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    await history_archive_collection.delete_one({"_id": archive["_id"]})
+    return True
+
+
+def _inactive_since(cutoff: datetime) -> dict:
+    return {"updated_at": {"$lt": cutoff}}
+
+
+async def sweep(now: datetime = None) -> dict:
+    """Apply the retention policies once"""
+    now = now or datetime.utcnow()
+    stats = {"deleted": 0, "archived": 0, "skipped": 0}
+    if not (HISTORY_RETENTION_DAYS or HISTORY_ARCHIVE_AFTER_DAYS):
+        return stats
+
+    # Histories from before updated_at existed count as active since creation
+    await history_collection.update_many(
+        {"updated_at": None},
+        [{"$set": {"updated_at": {"$ifNull": ["$created_at", now]}}}]
+    )
+
+    if HISTORY_RETENTION_DAYS:
+        cutoff = now - timedelta(days=HISTORY_RETENTION_DAYS)
+        expired = await history_collection.find(
+            _inactive_since(cutoff), {"_id": 1, "user_id": 1}
+        ).limit(RETENTION_BATCH).to_list(length=RETENTION_BATCH)
+        for history in expired:
+            result = await history_collection.delete_one({"_id": history["_id"], **_inactive_since(cutoff)})
+            if result.deleted_count:
+                await asyncio.gather(
+                    purge_messages(str(history["_id"])),
+                    bump_user_histories(history.get("user_id") or "")
+                )
+                stats["deleted"] += 1
+
+    if HISTORY_ARCHIVE_AFTER_DAYS:
+        cutoff = now - timedelta(days=HISTORY_ARCHIVE_AFTER_DAYS)
+        cold = await history_collection.find(
+            {**_inactive_since(cutoff), "archived": {"$ne": True}, "archive_skipped": {"$ne": True}},
+            {"user_id": 1, "created_at": 1, "updated_at": 1}
+        ).limit(RETENTION_BATCH).to_list(length=RETENTION_BATCH)
+        for history in cold:
+            if await archive_history(history):
+                stats["archived"] += 1
+            else:
+                stats["skipped"] += 1
+    return stats
+
+
+async def acquire_lease(name: str, seconds: float) -> bool:
+    """Hold a named lease for seconds unless another worker holds it"""
+    now = datetime.utcnow()
+    try:
+        await lease_collection.find_one_and_update(
+            {"_id": name, "$or": [{"until": {"$lte": now}}, {"owner": _owner}]},
+            {"$set": {"owner": _owner, "until": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def sweeper(stop: asyncio.Event):
+    """Run a sweep every RETENTION_INTERVAL seconds on one worker at a time"""
+    while not stop.is_set():
+        try:
+            if await acquire_lease("retention", RETENTION_INTERVAL):
+                stats = await sweep()
+                if stats["deleted"] or stats["archived"]:
+                    print(f"Retention sweep: {stats}")
+        except Exception as e:
+            print(f"Retention sweep failed: {e}")
+        try:
+            await asyncio.wait_for(stop.wait(), RETENTION_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_retention():
+    """Start the periodic sweep on the running loop if a policy is configured"""
+    global _sweeper
+    _stop.clear()
+    if HISTORY_RETENTION_DAYS or HISTORY_ARCHIVE_AFTER_DAYS:
+        _sweeper = asyncio.create_task(sweeper(_stop))
+
+
+async def stop_retention():
+    """Stop the sweep after the current round"""
+    global _sweeper
+    _stop.set()
+    if _sweeper is not None:
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
+
+
+async def main():
+    from app.indexes import ensure_indexes
+    await ensure_indexes()
+    print(f"Retention sweep: {await sweep()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
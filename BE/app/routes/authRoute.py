@@ -3,10 +3,19 @@ Authentication routes
 """
 from fastapi import APIRouter, HTTPException, Depends, status
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from pymongo.errors import DuplicateKeyError
 from app.database import user_collection
-from app.auth import get_password_hash, verify_password, create_access_token
-from app.utils import user_helper
+from fastapi.security import HTTPAuthorizationCredentials
+from app.auth import (
+    hash_password,
+    check_password,
+    needs_rehash,
+    create_access_token,
+    security,
+    verify_token,
+    revoke_token
+)
+from app.utils import user_helper, mongo_now
 
 router = APIRouter(
     prefix="/api/auth",
@@ -44,18 +53,25 @@ async def register(user: UserCreate):
         )
     
     # Hash password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     
     # Create user document
     user_doc = {
         "username": user.username,
         "email": user.email,
         "password": hashed_password,
-        "created_at": datetime.utcnow()
+        "created_at": mongo_now()
     }
     
-    result = await user_collection.insert_one(user_doc)
-    created_user = await user_collection.find_one({"_id": result.inserted_id})
+    try:
+        result = await user_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Concurrent registration lost the race on the unique indexes
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email or username already registered"
+        )
+    created_user = {**user_doc, "_id": result.inserted_id}
     
     return {"message": "User created successfully", "user": user_helper(created_user)}
 
@@ -65,12 +81,19 @@ async def login(credentials: UserLogin):
     """Login user and return JWT token"""
     user = await user_collection.find_one({"email": credentials.email})
     
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user or not await check_password(credentials.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    # Upgrade the stored hash when the configured bcrypt cost changed
+    if needs_rehash(user["password"]):
+        await user_collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"password": await hash_password(credentials.password)}}
+        )
+    
     # Create access token
     token_data = {"user_id": str(user["_id"]), "email": user["email"]}
     access_token = create_access_token(token_data)
@@ -80,3 +103,13 @@ async def login(credentials: UserLogin):
         "token_type": "bearer",
         "user": user_helper(user)
     }
+
+
+@router.post("/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    token_data: dict = Depends(verify_token)
+):
+    """Revoke the current access token"""
+    await revoke_token(credentials.credentials, token_data)
+    return {"message": "Logged out successfully"}
@@ -1,13 +1,26 @@
 """
 History routes
 """
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from typing import Optional
 from bson import ObjectId
-from datetime import datetime
 from app.database import history_collection
-from app.schemas import ChatHistory
+from app.schemas import ChatHistory, HistoryPage
 from app.auth import verify_token
-from app.utils import history_helper
+from app.ratelimit import admit_user
+from app.utils import history_helper, mongo_now, HISTORY_FIELDS
+from app.pagination import fetch_page, encode_cursor
+from app.retention import schedule_purge
+from app.transfer import export_user, import_user
+from app.conditional import (
+    bump_user_histories,
+    user_histories_etag,
+    cache_headers,
+    is_not_modified,
+    not_modified
+)
 
 router = APIRouter(
     prefix="/api/history",
@@ -23,41 +36,81 @@ async def save_chat_history(
     """Save chat history"""
     user_id = token_data["user_id"]
     
+    now = mongo_now()
     history_doc = {
         "user_id": user_id,
         "messages": [msg.dict() for msg in history.messages],
-        "created_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     result = await history_collection.insert_one(history_doc)
-    created_history = await history_collection.find_one({"_id": result.inserted_id})
+    await bump_user_histories(user_id)
+    created_history = {**history_doc, "_id": result.inserted_id}
     
     return {"message": "History saved", "data": history_helper(created_history)}
 
 
-@router.get("/")
+@router.get("/", response_model=HistoryPage)
 async def get_chat_history(
+    request: Request,
     token_data: dict = Depends(verify_token),
-    limit: int = 20,
-    skip: int = 0
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0)
 ):
-    """Get user's chat history with pagination"""
+    """Get user's chat history, newest first, with cursor pagination.
+
+    Pass the returned `next_cursor` to get the following page. `skip` is
+    still accepted for older clients when no cursor is given. Answers 304
+    when If-None-Match carries the current ETag of the user's history list.
+    """
     user_id = token_data["user_id"]
+    version = await user_histories_etag(user_id)
+    headers = cache_headers(*version) if version else None
+    if version and is_not_modified(request, version[0]):
+        return not_modified(headers)
     
-    # Get total count for pagination info
-    total_count = await history_collection.count_documents({"user_id": user_id})
-    
-    # Get paginated history
-    cursor = history_collection.find({"user_id": user_id}).sort("created_at", -1).skip(skip).limit(limit)
-    histories = await cursor.to_list(length=limit)
+    if cursor or not skip:
+        histories, next_cursor, has_more = await fetch_page(
+            history_collection, {"user_id": user_id}, "created_at", -1, limit, cursor, HISTORY_FIELDS
+        )
+    else:
+        # Legacy offset pagination; has_more still comes from fetching limit + 1
+        histories = await history_collection.find({"user_id": user_id}, HISTORY_FIELDS).sort(
+            [("created_at", -1), ("_id", -1)]
+        ).skip(skip).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(histories) > limit
+        histories = histories[:limit]
+        next_cursor = encode_cursor(histories[-1].get("created_at"), histories[-1]["_id"]) if has_more else None
     
-    return {
+    return ORJSONResponse({
         "history": [history_helper(hist) for hist in histories],
-        "total": total_count,
+        "next_cursor": next_cursor,
         "skip": skip,
         "limit": limit,
-        "has_more": (skip + limit) < total_count
-    }
+        "has_more": has_more
+    }, headers=headers)
+
+
+@router.get("/export")
+async def export_chat_history(token_data: dict = Depends(verify_token)):
+    """Stream all of the user's conversations and messages as NDJSON"""
+    return StreamingResponse(
+        export_user(token_data["user_id"]),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="history.ndjson"'}
+    )
+
+
+@router.post("/import")
+async def import_chat_history(request: Request, token_data: dict = Depends(admit_user)):
+    """Import conversations from an NDJSON upload in the export format.
+
+    The body is read as a stream and written in batches; histories and
+    messages get new ids.
+    """
+    return await import_user(token_data["user_id"], request.stream())
 
 
 @router.delete("/{history_id}")
@@ -65,7 +118,7 @@ async def delete_chat_history(
     history_id: str,
     token_data: dict = Depends(verify_token)
 ):
-    """Delete a specific chat history"""
+    """Delete a specific chat history; its messages are deleted in the background"""
     user_id = token_data["user_id"]
     
     result = await history_collection.delete_one({
@@ -79,4 +132,6 @@ async def delete_chat_history(
             detail="History not found"
         )
     
+    await asyncio.gather(schedule_purge(user_id, history_id), bump_user_histories(user_id))
+    
     return {"message": "History deleted successfully"}
@@ -1,138 +1,254 @@
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import os
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from bson import ObjectId
 from datetime import datetime
+from typing import Optional
 from app.database import message_collection, history_collection
-from app.schemas import Message
+from app.schemas import Message, MessageOut, MessageList, MessagePage, SearchPage
 from app.auth import verify_token
-from app.utils import message_helper
-from groq import Groq
-import os
-from dotenv import load_dotenv
+from app.ratelimit import admit_user, charge_llm_tokens, refund_llm_tokens
+from app.utils import message_helper, sse_event, mongo_now, estimate_tokens, MESSAGE_FIELDS
+from app.llm import llm_client
+from app.conversation import build_conversation, CONTEXT_MAX_TOKENS, MEMORY_SUMMARY_MAX_TOKENS
+from app.pagination import fetch_page, keyset_filter, merge_page
+from app.retention import archived_messages
+from app.search import search_messages, SEARCH_MAX_RESULTS
+from app.conditional import (
+    bump_history,
+    bump_user_histories,
+    get_history_version,
+    history_etag,
+    cache_headers,
+    is_not_modified,
+    not_modified
+)
 
-load_dotenv()
+CHAT_REPLY_MAX_TOKENS = int(os.getenv("CHAT_REPLY_MAX_TOKENS", "1000"))
+
+_finish_tasks = set()  # stream endings still being saved after a disconnect
 
 router = APIRouter(
     prefix="/api/messages",
     tags=["messages"]
 )
 
-# Initialize Groq client for summarization
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+
+def _new_history(message: Message, user_id: str):
+    """Return (history_id, history_doc); history_doc is only set when a new history must be created"""
+    if message.history_id:
+        return message.history_id, None
+    now = mongo_now()
+    history_doc = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "created_at": now,
+        "updated_at": now
+    }
+    return str(history_doc["_id"]), history_doc
+
+
+async def _insert_history(history_doc: dict):
+    await history_collection.insert_one(history_doc)
+    await bump_user_histories(history_doc["user_id"])
+
+
+def _message_doc(history_id: str, user_id: str, role: str, content: str, timestamp: datetime = None) -> dict:
+    # Ids are generated client-side so responses never need a read-back
+    return {
+        "_id": ObjectId(),
+        "history_id": history_id,
+        "user_id": user_id,  # owner, the prefix of the search index
+        "role": role,
+        "content": content,
+        "timestamp": timestamp or mongo_now()
+    }
+
+
+def _placeholder_response(content: str) -> str:
+    # Fallback if Groq API key is not configured
+    return f"This is a placeholder response. Original text length: {len(content)} characters. Please configure GROQ_API_KEY in your .env file."
+
+
+def _error_response(error: Exception) -> str:
+    return f"Error generating response: {str(error)}. Please check your Groq API configuration."
+
+
+def _token_reservation(content: str) -> int:
+    """Most tokens a chat turn can use: the prompt build_conversation can assemble plus a full reply"""
+    return max(CONTEXT_MAX_TOKENS, estimate_tokens(content)) + MEMORY_SUMMARY_MAX_TOKENS + CHAT_REPLY_MAX_TOKENS
+
+
+def _tokens_used(conversation_messages: list, reply: str) -> int:
+    return sum(estimate_tokens(m["content"]) for m in conversation_messages) + estimate_tokens(reply)
+
+
+async def _generate_reply(conversation_messages: list, content: str) -> str:
+    """Generate the assistant reply, falling back to an explanatory message on failure"""
+    try:
+        if llm_client:
+            # Use the shared async LLM client with the conversation context
+            return await llm_client.complete(
+                messages=conversation_messages,
+                temperature=0.7,
+                max_tokens=CHAT_REPLY_MAX_TOKENS,
+            )
+        return _placeholder_response(content)
+    except Exception as e:
+        # Fallback on error
+        return _error_response(e)
+
+
+async def _archived_page(history: dict, user_id: str, limit: int, cursor: str = None) -> tuple:
+    """One page of an archived history, read from the archive plus any messages written since"""
+    keyset = keyset_filter("timestamp", cursor, 1) if cursor else {}
+    order = [("timestamp", 1), ("_id", 1)]
+    live, archived = await asyncio.gather(
+        message_collection.find({"history_id": str(history["_id"]), **keyset}, MESSAGE_FIELDS)
+        .sort(order).limit(limit + 1).to_list(length=limit + 1),
+        archived_messages({"_id": history["_id"], "user_id": user_id}, keyset, order, limit + 1)
+    )
+    return merge_page([live, archived], "timestamp", 1, limit)
+
 
 @router.post("/", response_model=dict)
 async def create_message(
     message: Message,
-    token_data: dict = Depends(verify_token)
+    token_data: dict = Depends(admit_user)
 ):
     """Save a message to the database, generate AI summary using Groq API as assistant response"""
     user_id = token_data["user_id"]
-
-    # If no history_id, create a new history entry
-    if not message.history_id:
-        # Create new history
-        history_doc = {
-            "user_id": user_id,
-            "created_at": datetime.utcnow()
-        }
-        history_result = await history_collection.insert_one(history_doc)
-        history_id = str(history_result.inserted_id)
-    else:
-        history_id = message.history_id
-
-    # Save user's message
-    message_dict = {
-        "history_id": history_id,
-        "role": message.role,
-        "content": message.content,
-        "timestamp": message.timestamp or datetime.utcnow()
-    }
-    user_message_result = await message_collection.insert_one(message_dict)
-    created_user_message = await message_collection.find_one({"_id": user_message_result.inserted_id})
+    history_id, history_doc = _new_history(message, user_id)
+    user_message = _message_doc(history_id, user_id, message.role, message.content, message.timestamp)
 
     # Generate assistant message only if this is a user message
     if message.role == "user":
-        # Fetch conversation history for context (like ChatGPT)
-        conversation_messages = []
-        
-        # Get previous messages in this conversation (limit to last 20 messages to avoid token limits)
-        # We fetch messages before the current one to get conversation context
-        previous_messages_cursor = message_collection.find(
-            {"history_id": history_id}
-        ).sort("timestamp", 1)
-        
-        previous_messages = []
-        async for msg in previous_messages_cursor:
-            # Skip the current message we just saved (it will be added separately)
-            if str(msg["_id"]) != str(user_message_result.inserted_id):
-                previous_messages.append(msg)
-        
-        # Limit to last 20 messages to manage token usage (keep most recent context)
-        if len(previous_messages) > 20:
-            previous_messages = previous_messages[-20:]
-        
-        # Build conversation history for Groq API
-        # Start with system message
-        conversation_messages.append({
-            "role": "system",
-            "content": "You are a helpful AI assistant that provides concise and accurate summaries of text. You can also engage in conversation and answer questions. When asked to summarize text, provide clear and informative summaries. Maintain context from previous messages in the conversation and respond naturally based on the conversation history."
-        })
-        
-        # Add all previous messages to maintain conversation context
-        for prev_msg in previous_messages:
-            conversation_messages.append({
-                "role": prev_msg["role"],
-                "content": prev_msg["content"]
-            })
-        
-        # Add the current user message
-        conversation_messages.append({
-            "role": "user",
-            "content": message.content
-        })
-        
-        # Generate response using Groq API with conversation history
-        try:
-            if groq_client:
-                # Use Groq API with full conversation history
-                chat_completion = groq_client.chat.completions.create(
-                    messages=conversation_messages,
-                    model="llama-3.3-70b-versatile",  # Updated to current Groq model
-                    temperature=0.7,
-                    max_tokens=1000,  # Increased for better responses
-                )
-                assistant_content = chat_completion.choices[0].message.content.strip()
-            else:
-                # Fallback if Groq API key is not configured
-                assistant_content = f"This is a placeholder response. Original text length: {len(message.content)} characters. Please configure GROQ_API_KEY in your .env file."
-        except Exception as e:
-            # Fallback on error
-            assistant_content = f"Error generating response: {str(e)}. Please check your Groq API configuration."
-        
-        # Save assistant's message
-        assistant_dict = {
-            "history_id": history_id,
-            "role": "assistant",
-            "content": assistant_content,
-            "timestamp": datetime.utcnow()
-        }
-        assistant_message_result = await message_collection.insert_one(assistant_dict)
-        created_assistant_message = await message_collection.find_one({"_id": assistant_message_result.inserted_id})
-        
+        # Reserve the worst case now, settle once the prompt and reply are known
+        reserved = await charge_llm_tokens(user_id, _token_reservation(message.content))
+
+        async def reply() -> str:
+            # A brand-new history has no previous messages to read
+            conversation_messages = await build_conversation(
+                None if history_doc else history_id, user_message
+            )
+            content = await _generate_reply(conversation_messages, message.content)
+            await refund_llm_tokens(user_id, reserved - _tokens_used(conversation_messages, content))
+            return content
+
+        if history_doc:
+            # Create the history while the model is generating
+            _, assistant_content = await asyncio.gather(
+                _insert_history(history_doc),
+                reply()
+            )
+        else:
+            assistant_content = await reply()
+
+        # Save both messages in one round trip, then bump the version listings are tagged with
+        assistant_message = _message_doc(history_id, user_id, "assistant", assistant_content)
+        await message_collection.insert_many([user_message, assistant_message])
+        await bump_history(history_id)
+
         # Return both messages: user message and assistant message
         return {
-            "user_message": message_helper(created_user_message),
-            "assistant_message": message_helper(created_assistant_message),
+            "user_message": message_helper(user_message),
+            "assistant_message": message_helper(assistant_message),
             "history_id": history_id
         }
     else:
-        # If it's not a user message (e.g., assistant message), just return the saved message
+        # If it's not a user message (e.g., assistant message), just save and return it
+        if history_doc:
+            await _insert_history(history_doc)
+        await message_collection.insert_one(user_message)
+        await bump_history(history_id)
         return {
-            "message": message_helper(created_user_message),
+            "message": message_helper(user_message),
             "history_id": history_id
         }
 
-@router.get("/", response_model=dict)
+
+@router.post("/stream")
+async def create_message_stream(
+    message: Message,
+    token_data: dict = Depends(admit_user)
+):
+    """Save a user message and stream the assistant response as Server-Sent Events.
+
+    Tokens are sent as `data: {"delta": ...}` frames; the assistant message is
+    persisted once the stream finishes and returned in the final `done` event.
+    """
+    if message.role != "user":
+        raise HTTPException(status_code=400, detail="Only user messages can be streamed")
+
+    user_id = token_data["user_id"]
+    reserved = await charge_llm_tokens(user_id, _token_reservation(message.content))
+    history_id, history_doc = _new_history(message, user_id)
+    user_message = _message_doc(history_id, user_id, message.role, message.content, message.timestamp)
+
+    async def save_user_message():
+        writes = [message_collection.insert_one(user_message)]
+        if history_doc:
+            writes.insert(0, _insert_history(history_doc))
+        await asyncio.gather(*writes)
+        await bump_history(history_id)
+
+    # Save the user message and read the context concurrently
+    _, conversation_messages = await asyncio.gather(
+        save_user_message(),
+        build_conversation(None if history_doc else history_id, user_message)
+    )
+
+    async def finish(assistant_content: str) -> dict:
+        await refund_llm_tokens(user_id, reserved - _tokens_used(conversation_messages, assistant_content))
+        assistant_message = _message_doc(history_id, user_id, "assistant", assistant_content)
+        await message_collection.insert_one(assistant_message)
+        await bump_history(history_id)
+        return assistant_message
+
+    async def event_stream():
+        yield sse_event({"user_message": message_helper(user_message), "history_id": history_id}, event="start")
+        parts = []
+        assistant_content = None
+        try:
+            if llm_client:
+                async for delta in llm_client.stream(
+                    messages=conversation_messages,
+                    temperature=0.7,
+                    max_tokens=CHAT_REPLY_MAX_TOKENS,
+                ):
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+                assistant_content = "".join(parts).strip()
+            else:
+                assistant_content = _placeholder_response(message.content)
+                yield sse_event({"delta": assistant_content})
+        except Exception as e:
+            assistant_content = _error_response(e)
+            yield sse_event({"detail": assistant_content}, event="error")
+        finally:
+            # A client disconnect cancels the stream: keep the partial reply and settle
+            # the budget anyway, in a task the cancellation cannot reach
+            if assistant_content is None:
+                assistant_content = "".join(parts).strip()
+            task = asyncio.ensure_future(finish(assistant_content))
+            _finish_tasks.add(task)
+            task.add_done_callback(_finish_tasks.discard)
+            assistant_message = await asyncio.shield(task)
+
+        yield sse_event({
+            "user_message": message_helper(user_message),
+            "assistant_message": message_helper(assistant_message),
+            "history_id": history_id
+        }, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/", response_model=MessageList)
 async def get_messages(
     token_data: dict = Depends(verify_token),
     history_id: str = None,
@@ -143,37 +259,85 @@ async def get_messages(
     
     query = {}
     if history_id:
+        history = await get_history_version(history_id)
+        histories = [history] if history else []
         query["history_id"] = history_id
     else:
         # Get all histories for user and fetch their messages
-        histories = await history_collection.find({"user_id": user_id}).to_list(length=100)
-        history_ids = [str(h["_id"]) for h in histories]
-        query["history_id"] = {"$in": history_ids}
+        histories = await history_collection.find(
+            {"user_id": user_id}, {"_id": 1, "archived": 1}
+        ).to_list(length=100)
+        query["history_id"] = {"$in": [str(h["_id"]) for h in histories]}
+    # Archived conversations are read from their archive without restoring them
+    archived_ids = [h["_id"] for h in histories if h.get("archived")]
     
-    cursor = message_collection.find(query).sort("timestamp", 1).limit(limit)
+    cursor = message_collection.find(query, MESSAGE_FIELDS).sort("timestamp", 1).limit(limit)
     messages = await cursor.to_list(length=limit)
+    if archived_ids:
+        archived = await archived_messages(
+            {"_id": {"$in": archived_ids}, "user_id": user_id}, sort=[("timestamp", 1), ("_id", 1)], limit=limit
+        )
+        messages, _, _ = merge_page([messages, archived], "timestamp", 1, limit)
     
-    return {"messages": [message_helper(msg) for msg in messages]}
+    return ORJSONResponse({"messages": [message_helper(msg) for msg in messages]})
 
-@router.get("/{id}", response_model=dict)
+@router.get("/search", response_model=SearchPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    token_data: dict = Depends(verify_token),
+    limit: int = Query(20, ge=1, le=50),
+    skip: int = Query(0, ge=0, le=SEARCH_MAX_RESULTS)
+):
+    """Search the user's messages, best matches first.
+
+    `q` uses MongoDB text search syntax: words, "exact phrases" and
+    -excluded words. Each result has a snippet of the message and the
+    [start, end) offsets of the matched terms within it.
+    """
+    results, has_more = await search_messages(token_data["user_id"], q, skip, limit)
+    return ORJSONResponse({
+        "results": results,
+        "skip": skip,
+        "limit": limit,
+        "has_more": has_more
+    })
+
+@router.get("/{id}", response_model=MessageOut)
 async def get_message(
     id: str,
     token_data: dict = Depends(verify_token)
 ):
     """Get a specific message by ID"""
-    message = await message_collection.find_one({"_id": ObjectId(id)})
+    message = await message_collection.find_one({"_id": ObjectId(id)}, MESSAGE_FIELDS)
     if message is None:
         raise HTTPException(status_code=404, detail="Message not found")
     return message_helper(message)
 
-@router.get("/history/{history_id}", response_model=list)
+@router.get("/history/{history_id}", response_model=MessagePage)
 async def get_messages_by_history(
     history_id: str,
-    token_data: dict = Depends(verify_token)
+    request: Request,
+    token_data: dict = Depends(verify_token),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None
 ):
-    """Get all messages for a specific history"""
-    messages_cursor = message_collection.find({"history_id": history_id}).sort("timestamp", 1)
-    messages = []
-    async for message in messages_cursor:
-        messages.append(message_helper(message))
-    return messages
+    """Get messages for a specific history in chronological order, one page at a time.
+
+    Pass the returned `next_cursor` to get the following page. Answers 304
+    when If-None-Match carries the current ETag of the history.
+    """
+    history = await get_history_version(history_id)
+    headers = cache_headers(*history_etag(history)) if history else None
+    if history and is_not_modified(request, headers["ETag"]):
+        return not_modified(headers)
+    if history and history.get("archived"):
+        messages, next_cursor, has_more = await _archived_page(history, token_data["user_id"], limit, cursor)
+    else:
+        messages, next_cursor, has_more = await fetch_page(
+            message_collection, {"history_id": history_id}, "timestamp", 1, limit, cursor, MESSAGE_FIELDS
+        )
+    return ORJSONResponse({
+        "messages": [message_helper(message) for message in messages],
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }, headers=headers)
@@ -0,0 +1,56 @@
+"""
+Prometheus metrics route
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.cache import summary_cache
+from app.jobs import queue_depth
+from app.llm import llm_client
+from app.metrics import REGISTRY, Gauge, Counter
+from app.summarizer import summary_flight
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "LLM calls holding a concurrency slot")
+LLM_WAITING = Gauge("llm_waiting", "LLM calls waiting for a concurrency slot")
+LLM_BACKEND_AVAILABLE = Gauge(
+    "llm_backend_available", "Whether the circuit breaker lets calls through to a routed backend", ("backend",)
+)
+JOB_QUEUE_DEPTH = Gauge("summary_jobs_queued", "Summarization jobs waiting for a worker")
+SUMMARY_CACHE_LOOKUPS = Counter(
+    "summary_cache_lookups_total", "Summary cache lookups by result", ("result",)
+)
+SUMMARY_CACHE_SIZE = Gauge("summary_cache_entries", "Entries in the in-memory summary cache")
+SUMMARY_COALESCED = Counter(
+    "summary_coalesced_total", "Summarizations served by joining an identical in-flight call"
+)
+
+
+async def collect_runtime_metrics():
+    """Copy the current counters of the shared components into their metrics"""
+    if llm_client:
+        LLM_IN_FLIGHT.set(llm_client.in_flight)
+        LLM_WAITING.set(llm_client.waiting)
+        for backend in getattr(llm_client, "backends", ()):
+            LLM_BACKEND_AVAILABLE.set(int(backend.is_available()), backend=backend.name)
+    try:
+        JOB_QUEUE_DEPTH.set(await queue_depth())
+    except Exception as e:
+        print(f"Could not read the job queue depth: {e}")
+    stats = summary_cache.stats()
+    SUMMARY_CACHE_LOOKUPS.set(stats["memory_hits"], result="memory_hit")
+    SUMMARY_CACHE_LOOKUPS.set(stats["persistent_hits"], result="persistent_hit")
+    SUMMARY_CACHE_LOOKUPS.set(stats["misses"], result="miss")
+    SUMMARY_CACHE_SIZE.set(stats["size"])
+    SUMMARY_COALESCED.set(summary_flight.coalesced)
+
+
+REGISTRY.add_collector(collect_runtime_metrics)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    """Metrics of this worker in the Prometheus text format"""
+    return PlainTextResponse(await REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -1,10 +1,13 @@
 """
 User profile routes
 """
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, status
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from app.database import user_collection
-from app.auth import verify_token
+from app.auth import verify_token, get_current_user, invalidate_user
+from app.schemas import ProfileUpdate
 from app.utils import user_helper
 
 router = APIRouter(
@@ -14,11 +17,35 @@ router = APIRouter(
 
 
 @router.get("/profile")
-async def get_user_profile(token_data: dict = Depends(verify_token)):
+async def get_user_profile(user: dict = Depends(get_current_user)):
     """Get current user profile"""
+    return user_helper(user)
+
+
+@router.patch("/profile")
+async def update_user_profile(update: ProfileUpdate, token_data: dict = Depends(verify_token)):
+    """Change the current user's username or email"""
     user_id = token_data["user_id"]
+    changes = update.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nothing to update"
+        )
     
-    user = await user_collection.find_one({"_id": ObjectId(user_id)})
+    try:
+        user = await user_collection.find_one_and_update(
+            {"_id": ObjectId(user_id)},
+            {"$set": changes},
+            projection={"password": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email or username already registered"
+        )
+    invalidate_user(user_id)
     
     if not user:
         raise HTTPException(
@@ -1,76 +1,257 @@
 """
 Summarization routes
 """
-from fastapi import APIRouter, HTTPException, Depends, status
-from app.schemas import SummarizeRequest, SummarizeResponse
-from app.auth import verify_token
-from groq import Groq
+import asyncio
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, status
+from bson import ObjectId
+from fastapi.responses import StreamingResponse
+from app.schemas import (
+    SummarizeRequest,
+    SummarizeResponse,
+    SummarizeJobRequest,
+    BatchSummarizeRequest,
+    BatchSummarizeItem,
+    BatchSummarizeResponse
+)
+from app.auth import verify_token
+from app.ratelimit import admit_user, charge_llm_tokens
+from app.cache import summary_cache
+from app.jobs import submit_job, get_job, wait_for_job, job_helper
+from app.llm import llm_client, LLMUnavailable
+from app.summarizer import (
+    build_final_messages,
+    summarize,
+    summarize_extractive,
+    summary_cache_key,
+    summary_flight
+)
+from app.utils import sse_event, estimate_tokens
 
 router = APIRouter(
     prefix="/api/summarize",
     tags=["summarization"]
 )
 
-# Initialize Groq client
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = Groq(api_key=GROQ_API_KEY)
-
+SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", "2000000"))
+SUMMARY_BATCH_MAX_ITEMS = int(os.getenv("SUMMARY_BATCH_MAX_ITEMS", "1000"))
+SUMMARY_BATCH_CONCURRENCY = int(os.getenv("SUMMARY_BATCH_CONCURRENCY", "32"))
 
 
-@router.post("/", response_model=SummarizeResponse)
-async def summarize_text(
-    request: SummarizeRequest,
-    token_data: dict = Depends(verify_token)
-):
-    """Summarize the provided text using Groq API"""
+def _clean_text(request: SummarizeRequest) -> str:
     text = request.text.strip()
-    
     if not text:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Text cannot be empty"
         )
-    
-    # If Groq API key is not configured, return placeholder
-    if not groq_client:
-        summary = f"This is a placeholder summary of your text. Original text length: {len(text)} characters. Please configure GROQ_API_KEY in your .env file."
-        return SummarizeResponse(
-            summary=summary,
-            original_length=len(text),
-            summary_length=len(summary)
+    if estimate_tokens(text) > SUMMARY_MAX_INPUT_TOKENS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Text exceeds the {SUMMARY_MAX_INPUT_TOKENS} token limit"
         )
-    
+    return text
+
+
+def _summary_response(text: str, summary: str, mode: str) -> SummarizeResponse:
+    return SummarizeResponse(
+        summary=summary,
+        original_length=len(text),
+        summary_length=len(summary),
+        mode=mode
+    )
+
+
+@router.post("/", response_model=SummarizeResponse)
+async def summarize_text(
+    request: SummarizeRequest,
+    response: Response,
+    token_data: dict = Depends(admit_user)
+):
+    """Summarize the provided text using Groq API"""
+    text = _clean_text(request)
+    await charge_llm_tokens(token_data["user_id"], estimate_tokens(text))
+
     try:
-        # Use Groq API to generate summary
-        chat_completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",  # Updated to current Groq model (replaces deprecated llama-3.1-70b-versatile)
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that provides concise and accurate summaries of text. Summarize the given text in a clear and informative way."
-                },
-                {
-                    "role": "user",
-                    "content": f"Please summarize the following text:\n\n{text}"
-                }
-            ],
-            temperature=0.7,
-            max_tokens=500,
-        )
-        
-        summary = chat_completion.choices[0].message.content.strip()
-        
-        return SummarizeResponse(
-            summary=summary,
-            original_length=len(text),
-            summary_length=len(summary)
+        summary, cache_hit, mode = await summarize(text, request.bypass_cache, request.mode)
+    except LLMUnavailable as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
         )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error generating summary: {str(e)}"
         )
+
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
+    return _summary_response(text, summary, mode)
+
+
+async def _summarize_item(index: int, item: SummarizeRequest, semaphore: asyncio.Semaphore) -> BatchSummarizeItem:
+    """Summarize one batch item, turning failures into a per-item error"""
+    async with semaphore:
+        try:
+            text = _clean_text(item)
+            summary, _, mode = await summarize(text, item.bypass_cache, item.mode)
+            return BatchSummarizeItem(index=index, result=_summary_response(text, summary, mode))
+        except HTTPException as e:
+            return BatchSummarizeItem(index=index, error=e.detail)
+        except Exception as e:
+            return BatchSummarizeItem(index=index, error=f"Error generating summary: {str(e)}")
+
+
+async def _batch_tasks(request: BatchSummarizeRequest, user_id: str) -> list:
+    if len(request.items) > SUMMARY_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch can contain at most {SUMMARY_BATCH_MAX_ITEMS} items"
+        )
+    await charge_llm_tokens(user_id, sum(estimate_tokens(item.text) for item in request.items))
+    concurrency = min(request.concurrency or SUMMARY_BATCH_CONCURRENCY, SUMMARY_BATCH_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    return [
+        asyncio.ensure_future(_summarize_item(index, item, semaphore))
+        for index, item in enumerate(request.items)
+    ]
+
+
+@router.post("/batch", response_model=BatchSummarizeResponse)
+async def summarize_batch(
+    request: BatchSummarizeRequest,
+    token_data: dict = Depends(admit_user)
+):
+    """Summarize many texts with bounded concurrency; failed items do not fail the batch"""
+    tasks = await _batch_tasks(request, token_data["user_id"])
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    failed = sum(1 for item in results if item.error is not None)
+    return BatchSummarizeResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed
+    )
+
+
+@router.post("/batch/stream")
+async def summarize_batch_stream(
+    request: BatchSummarizeRequest,
+    token_data: dict = Depends(admit_user)
+):
+    """Summarize many texts, emitting one NDJSON line per item as soon as it finishes"""
+    tasks = await _batch_tasks(request, token_data["user_id"])
+
+    async def result_stream():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                yield item.model_dump_json(exclude_none=True) + "\n"
+        finally:
+            # Client went away: stop the remaining work
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_summarize_job(
+    request: SummarizeJobRequest,
+    token_data: dict = Depends(admit_user)
+):
+    """Queue a summarization and return its job id immediately"""
+    text = _clean_text(request)
+    await charge_llm_tokens(token_data["user_id"], estimate_tokens(text))
+    job = await submit_job(
+        token_data["user_id"], text, request.bypass_cache, request.mode, request.priority
+    )
+    return {"job_id": str(job["_id"]), "status": job["status"]}
+
+
+@router.get("/jobs/{job_id}")
+async def get_summarize_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60),
+    token_data: dict = Depends(verify_token)
+):
+    """Get a job's status and result; `wait` long-polls up to that many seconds for it to finish"""
+    job = None
+    if ObjectId.is_valid(job_id):
+        if wait:
+            job = await wait_for_job(job_id, token_data["user_id"], wait)
+        else:
+            job = await get_job(job_id, token_data["user_id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_helper(job)
+
+
+@router.post("/stream")
+async def summarize_text_stream(
+    request: SummarizeRequest,
+    token_data: dict = Depends(admit_user)
+):
+    """Summarize the provided text, streaming tokens as Server-Sent Events"""
+    text = _clean_text(request)
+    await charge_llm_tokens(token_data["user_id"], estimate_tokens(text))
+
+    async def event_stream():
+        use_llm = request.mode != "extractive" and llm_client is not None
+        if use_llm and request.mode == "auto" and llm_client.is_saturated():
+            use_llm = False
+
+        mode = "abstractive"
+        if not use_llm:
+            try:
+                summary, _, mode = await summarize(text, request.bypass_cache, request.mode)
+            except Exception as e:
+                yield sse_event({"detail": f"Error generating summary: {str(e)}"}, event="error")
+                return
+            yield sse_event({"delta": summary})
+        else:
+            cache_key = summary_cache_key(text, max_tokens=500)
+            summary = None if request.bypass_cache else await summary_cache.get(cache_key)
+            if summary is not None:
+                yield sse_event({"delta": summary})
+            else:
+                parts = []
+                try:
+                    # Long documents run the map step first, then the reduce step streams
+                    async for delta in llm_client.stream(
+                        messages=await build_final_messages(text),
+                        temperature=0.7,
+                        max_tokens=500,
+                    ):
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+                    summary = "".join(parts).strip()
+                    await summary_cache.set(cache_key, summary)
+                except Exception as e:
+                    if request.mode != "auto" or parts:
+                        yield sse_event({"detail": f"Error generating summary: {str(e)}"}, event="error")
+                        return
+                    # Nothing was sent yet, so the extractive summary can take over
+                    summary, mode = await summarize_extractive(text), "extractive"
+                    yield sse_event({"delta": summary})
+        yield sse_event({
+            "summary": summary,
+            "original_length": len(text),
+            "summary_length": len(summary),
+            "mode": mode
+        }, event="done")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(token_data: dict = Depends(verify_token)):
+    """Summary cache and request coalescing counters for this worker"""
+    return {**summary_cache.stats(), "coalescing": summary_flight.stats()}
@@ -9,10 +9,9 @@ router = APIRouter(prefix="/users",
 
 @router.post("/", response_model=dict)
 async def create_user(user: User):
-    new_user = await user_collection.insert_one(user.dict())
-    created_user = await user_collection.find_one(
-        {"_id": new_user.inserted_id}
-    )
+    user_doc = user.dict()
+    new_user = await user_collection.insert_one(user_doc)
+    created_user = {**user_doc, "_id": new_user.inserted_id}
     return user_helper(created_user)
 
 
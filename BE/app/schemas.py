@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class User(BaseModel):
@@ -8,6 +8,10 @@ class User(BaseModel):
     email: EmailStr
     password_hash: str
 
+class ProfileUpdate(BaseModel):
+    username: Optional[str] = Field(None, min_length=1)
+    email: Optional[EmailStr] = None
+
 class Message(BaseModel):
     id: Optional[str] = Field(None, alias="_id")
     history_id: Optional[str] = None  # PK of the history this message belongs to (optional, will be created if missing)
@@ -21,14 +25,89 @@ class History(BaseModel):
     created_at: Optional[datetime] = None
 
 
+# Response models of the list endpoints. They document the shape only:
+# the routes return ORJSONResponse directly, so FastAPI does not validate
+# and re-encode every item.
+class MessageOut(BaseModel):
+    id: str = Field(alias="_id")
+    history_id: str
+    role: str
+    content: str
+    timestamp: Optional[datetime] = None
+
+
+class MessageList(BaseModel):
+    messages: List[MessageOut]
+
+
+class MessagePage(MessageList):
+    next_cursor: Optional[str] = None
+    has_more: bool
+
+
+class SearchResult(BaseModel):
+    id: str = Field(alias="_id")
+    history_id: str
+    role: str
+    timestamp: Optional[datetime] = None
+    score: float
+    snippet: str
+    highlights: List[List[int]]  # [start, end) offsets of matched terms in snippet
+
+
+class SearchPage(BaseModel):
+    results: List[SearchResult]
+    skip: int
+    limit: int
+    has_more: bool
+
+
+class HistoryOut(BaseModel):
+    id: str = Field(alias="_id")
+    user_id: str
+    created_at: Optional[datetime] = None
+
+
+class HistoryPage(BaseModel):
+    history: List[HistoryOut]
+    next_cursor: Optional[str] = None
+    skip: int
+    limit: int
+    has_more: bool
+
+
 class SummarizeRequest(BaseModel):
     text: str
+    bypass_cache: bool = False  # skip cached summaries and regenerate
+    mode: Literal["extractive", "abstractive", "auto"] = "auto"
 
 
 class SummarizeResponse(BaseModel):
     summary: str
     original_length: int
     summary_length: int
+    mode: str = "abstractive"  # method that produced the summary
+
+
+class SummarizeJobRequest(SummarizeRequest):
+    priority: int = Field(0, ge=0, le=10)  # higher runs first
+
+
+class BatchSummarizeRequest(BaseModel):
+    items: List[SummarizeRequest]
+    concurrency: Optional[int] = None  # capped by SUMMARY_BATCH_CONCURRENCY
+
+
+class BatchSummarizeItem(BaseModel):
+    index: int  # position of the item in the request
+    result: Optional[SummarizeResponse] = None
+    error: Optional[str] = None
+
+
+class BatchSummarizeResponse(BaseModel):
+    results: List[BatchSummarizeItem]
+    succeeded: int
+    failed: int
 
 
 class ChatHistory(BaseModel):
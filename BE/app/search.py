@@ -0,0 +1,181 @@
+"""
+Full-text search over a user's messages
+
+Messages carry the `user_id` of their owner and a compound text index on
+(user_id, content) answers a search from that user's postings only, so
+its cost depends on the number of matches rather than on the size of the
+collection. Messages written before `user_id` was stored are backfilled
+the first time their owner searches. Archived conversations are found
+through a text index on the archive and searched in place, without
+restoring them.
+"""
+import asyncio
+import os
+import re
+from datetime import datetime
+from bson import ObjectId
+from app.database import (
+    history_collection,
+    message_collection,
+    user_collection,
+    history_archive_collection
+)
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "200"))  # deepest result a page can reach
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+SEARCH_ARCHIVE_LIMIT = int(os.getenv("SEARCH_ARCHIVE_LIMIT", "20"))  # archived conversations searched per query
+
+SEARCH_FIELDS = {
+    "history_id": 1,
+    "role": 1,
+    "content": 1,
+    "timestamp": 1,
+    "score": {"$meta": "textScore"},
+}
+
+_owned_users = set()  # users whose messages all carry user_id
+_SUFFIXES = ("ies", "ing", "ed", "es", "ly", "s", "y")
+
+
+async def ensure_message_owner(user_id: str):
+    """Set user_id on the user's older messages, once per user"""
+    if user_id in _owned_users or not ObjectId.is_valid(user_id):
+        return
+    user = await user_collection.find_one({"_id": ObjectId(user_id)}, {"messages_owned": 1})
+    if user is not None and not user.get("messages_owned"):
+        histories = await history_collection.find({"user_id": user_id}, {"_id": 1}).to_list(length=None)
+        history_ids = [str(h["_id"]) for h in histories]
+        if history_ids:
+            await message_collection.update_many(
+                {"history_id": {"$in": history_ids}, "user_id": None},
+                {"$set": {"user_id": user_id}}
+            )
+        await user_collection.update_one({"_id": ObjectId(user_id)}, {"$set": {"messages_owned": True}})
+    _owned_users.add(user_id)
+
+
+def query_terms(query: str) -> list:
+    """Words and phrases of a $text query that a match contains; negated terms are left out"""
+    phrases = re.findall(r'"([^"]+)"', query)
+    words = [w for w in re.sub(r'"[^"]*"', " ", query).split() if not w.startswith("-")]
+    return [t for t in phrases + words if t.strip()]
+
+
+def _stem(word: str) -> str:
+    # Rough match for the stemming of the text index: "summaries" also highlights "summary" and "summarize"
+    word = word.lower()
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def _term_pattern(terms: list):
+    parts = []
+    for term in terms:
+        words = re.findall(r"\w+", term)
+        if len(words) > 1:
+            parts.append(r"\b" + r"\W+".join(re.escape(w) for w in words) + r"\b")
+        elif words:
+            parts.append(r"\b" + re.escape(_stem(words[0])) + r"\w*")
+    return re.compile("|".join(parts), re.IGNORECASE) if parts else None
+
+
+def highlight(content: str, terms: list, width: int = SEARCH_SNIPPET_CHARS) -> tuple:
+    """Return (snippet, highlights): about width characters around the first
+    match and the [start, end) offsets of the matched terms within it.
+
+    Offsets rather than markup keep the message text free of HTML.
+    """
+    pattern = _term_pattern(terms)
+    matches = list(pattern.finditer(content)) if pattern else []
+    if not matches:
+        snippet = content[:width]
+        return snippet + ("..." if len(content) > width else ""), []
+
+    # Centre the window on the first match and move it onto word boundaries
+    first = matches[0]
+    start = max(0, first.start() - (width - (first.end() - first.start())) // 2)
+    end = min(len(content), start + width)
+    start = max(0, end - width)
+    if start > 0:
+        space = content.find(" ", start, first.start())
+        start = space + 1 if space != -1 else start
+    if end < len(content):
+        space = content.rfind(" ", first.end(), end)
+        end = space if space != -1 else end
+
+    prefix = "..." if start > 0 else ""
+    snippet = prefix + content[start:end] + ("..." if end < len(content) else "")
+    offset = len(prefix) - start
+    highlights = [
+        [m.start() + offset, m.end() + offset]
+        for m in matches if m.start() >= start and m.end() <= end
+    ]
+    return snippet, highlights
+
+
+async def search_archives(user_id: str, query: str, limit: int) -> list:
+    """Matching messages of the user's archived conversations, best first.
+
+    The archive text index picks the conversations; within them, messages
+    are matched on the query terms and scored like their conversation.
+    """
+    pattern = _term_pattern(query_terms(query))
+    if pattern is None:
+        return []
+    return await history_archive_collection.aggregate([
+        {"$match": {"user_id": user_id, "$text": {"$search": query}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$sort": {"score": -1}},
+        {"$limit": SEARCH_ARCHIVE_LIMIT},
+        {"$unwind": "$messages"},
+        {"$match": {"messages.content": {"$regex": pattern.pattern, "$options": "i"}}},
+        {"$project": {
+            "_id": "$messages._id",
+            "history_id": {"$toString": "$_id"},
+            "role": "$messages.role",
+            "content": "$messages.content",
+            "timestamp": "$messages.timestamp",
+            "score": 1,
+        }},
+        {"$sort": {"score": -1, "timestamp": -1}},
+        {"$limit": limit},
+    ]).to_list(length=limit)
+
+
+def _rank(doc: dict) -> tuple:
+    return doc.get("score", 0.0), doc.get("timestamp") or datetime.min
+
+
+async def search_messages(user_id: str, query: str, skip: int, limit: int) -> tuple:
+    """Return (results, has_more) for one page of the user's messages ranked by relevance.
+
+    Live and archived matches are ranked together, so both sources are read
+    from the top down to the end of the page; SEARCH_MAX_RESULTS bounds that depth.
+    """
+    await ensure_message_owner(user_id)
+    depth = skip + limit + 1
+    live, archived = await asyncio.gather(
+        message_collection.find(
+            {"user_id": user_id, "$text": {"$search": query}},
+            SEARCH_FIELDS
+        ).sort([("score", {"$meta": "textScore"}), ("timestamp", -1)]).limit(depth).to_list(length=depth),
+        search_archives(user_id, query, depth)
+    )
+    docs = sorted(live + archived, key=_rank, reverse=True)[skip:depth]
+
+    has_more = len(docs) > limit and skip + limit < SEARCH_MAX_RESULTS
+    terms = query_terms(query)
+    results = []
+    for doc in docs[:limit]:
+        snippet, highlights = highlight(doc.get("content", ""), terms)
+        results.append({
+            "_id": str(doc["_id"]),
+            "history_id": str(doc.get("history_id", "")),
+            "role": doc.get("role", ""),
+            "timestamp": doc.get("timestamp"),
+            "score": round(doc.get("score", 0.0), 4),
+            "snippet": snippet,
+            "highlights": highlights,
+        })
+    return results, has_more
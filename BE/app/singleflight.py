@@ -0,0 +1,44 @@
+"""
+Single-flight request coalescing: concurrent calls with the same key share one execution
+"""
+import asyncio
+
+
+class SingleFlight:
+    """Deduplicate concurrent async calls by key.
+
+    The first caller for a key runs the work; callers arriving while it is in
+    flight await the same future and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        """Run fn() once per key among concurrent callers and return its result"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: one waiter disconnecting must not cancel the shared call
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+    def _done(self, key: str, future: asyncio.Future):
+        self._in_flight.pop(key, None)
+        # Mark the exception retrieved in case every waiter went away
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,233 @@
+"""
+Map-reduce summarization pipeline for documents larger than one model call
+"""
+import asyncio
+import os
+import re
+from app.cache import make_key, summary_cache
+from app.extractive import extractive_summary
+from app.llm import llm_client, LLM_MODELS, LLMUnavailable
+from app.singleflight import SingleFlight
+from app.utils import estimate_tokens
+
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "32"))
+SUMMARY_MAP_MAX_TOKENS = int(os.getenv("SUMMARY_MAP_MAX_TOKENS", "300"))
+SUMMARY_MAX_DEPTH = int(os.getenv("SUMMARY_MAX_DEPTH", "4"))
+SUMMARY_FALLBACK_TIMEOUT = float(os.getenv("SUMMARY_FALLBACK_TIMEOUT", "30"))  # seconds before auto mode goes extractive
+EXTRACTIVE_INLINE_TOKENS = 2000  # smaller texts are summarized directly on the loop
+
+SUMMARY_SYSTEM_PROMPT = "You are a helpful assistant that provides concise and accurate summaries of text. Summarize the given text in a clear and informative way."
+
+# Identical summaries in flight at the same time share one upstream call
+summary_flight = SingleFlight()
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def build_summary_messages(text: str) -> list:
+    """Build the chat prompt used to summarize a text in a single call"""
+    return [
+        {
+            "role": "system",
+            "content": SUMMARY_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"Please summarize the following text:\n\n{text}"
+        }
+    ]
+
+
+def build_section_messages(text: str) -> list:
+    """Prompt for the map step: one section of a longer document"""
+    return [
+        {
+            "role": "system",
+            "content": SUMMARY_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"The following is one section of a longer document. Summarize its key points concisely:\n\n{text}"
+        }
+    ]
+
+
+def build_reduce_messages(text: str) -> list:
+    """Prompt for the reduce step: combine section summaries into one"""
+    return [
+        {
+            "role": "system",
+            "content": SUMMARY_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"The following are summaries of consecutive sections of one document. Combine them into a single coherent summary of the whole document:\n\n{text}"
+        }
+    ]
+
+
+def _max_chars(max_tokens: int) -> int:
+    # Sizes are tracked in characters and converted once: estimate_tokens counts ~4 characters per token
+    return max_tokens * 4
+
+
+def _split_oversized(piece: str, max_tokens: int) -> list:
+    # A single sentence larger than the budget is split on word boundaries, a single huge word anywhere
+    max_chars = _max_chars(max_tokens)
+    chunks, current, size = [], [], 0
+    for word in piece.split():
+        while len(word) > max_chars:
+            if current:
+                chunks.append(" ".join(current))
+                current, size = [], 0
+            chunks.append(word[:max_chars])
+            word = word[max_chars:]
+        added = len(word) + (1 if current else 0)  # the joining space
+        if current and size + added > max_chars:
+            chunks.append(" ".join(current))
+            current, size, added = [], 0, len(word)
+        if word:
+            current.append(word)
+            size += added
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def split_text(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> list:
+    """Split text into chunks of at most max_tokens, preferring paragraph then sentence boundaries"""
+    max_chars = _max_chars(max_tokens)
+    pieces = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append((paragraph, "\n\n"))
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if len(sentence) <= max_chars:
+                pieces.append((sentence, " "))
+            else:
+                pieces.extend((part, " ") for part in _split_oversized(sentence, max_tokens))
+
+    chunks, current = [], ""
+    for piece, separator in pieces:
+        if current and len(current) + len(separator) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _map(text: str, build_messages) -> str:
+    """Summarize every chunk concurrently and join the partial summaries in order"""
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+    async def summarize_chunk(chunk: str) -> str:
+        async with semaphore:
+            return await llm_client.complete(
+                messages=build_messages(chunk),
+                temperature=0.3,
+                max_tokens=SUMMARY_MAP_MAX_TOKENS,
+            )
+
+    partials = await asyncio.gather(*(summarize_chunk(chunk) for chunk in split_text(text)))
+    return "\n\n".join(partials)
+
+
+async def build_final_messages(text: str) -> list:
+    """Return the prompt for the final summarization call.
+
+    Short texts are summarized directly. Longer ones are split into chunks that
+    are summarized in parallel (map), recursing over the joined partial
+    summaries until they fit in one call, which becomes the reduce prompt.
+    """
+    if estimate_tokens(text) <= SUMMARY_CHUNK_TOKENS:
+        return build_summary_messages(text)
+
+    combined = await _map(text, build_section_messages)
+    depth = 1
+    while estimate_tokens(combined) > SUMMARY_CHUNK_TOKENS and depth < SUMMARY_MAX_DEPTH:
+        combined = await _map(combined, build_reduce_messages)
+        depth += 1
+    if estimate_tokens(combined) > SUMMARY_CHUNK_TOKENS:
+        combined = split_text(combined)[0]
+    return build_reduce_messages(combined)
+
+
+def summary_cache_key(text: str, max_tokens: int = 500) -> str:
+    """Cache key covering the text and every setting that shapes the summary.
+
+    With several routed backends any of their models may write an entry, so
+    the key names the whole model set: changing the set invalidates the cache.
+    """
+    return make_key(text, ",".join(LLM_MODELS), SUMMARY_SYSTEM_PROMPT, {
+        "temperature": 0.7,
+        "max_tokens": max_tokens,
+        "chunk_tokens": SUMMARY_CHUNK_TOKENS,
+        "map_max_tokens": SUMMARY_MAP_MAX_TOKENS,
+    })
+
+
+async def summarize_document(text: str, max_tokens: int = 500) -> str:
+    """Summarize a document of any length"""
+    return await llm_client.complete(
+        messages=await build_final_messages(text),
+        temperature=0.7,
+        max_tokens=max_tokens,
+    )
+
+
+async def _generate_summary(text: str, cache_key: str) -> str:
+    summary = await summarize_document(text, max_tokens=500)
+    await summary_cache.set(cache_key, summary)
+    return summary
+
+
+async def summarize_extractive(text: str) -> str:
+    """Local extractive summary; large inputs are scored off the event loop"""
+    if estimate_tokens(text) < EXTRACTIVE_INLINE_TOKENS:
+        return extractive_summary(text)
+    return await asyncio.get_running_loop().run_in_executor(None, extractive_summary, text)
+
+
+async def summarize(text: str, bypass_cache: bool = False, mode: str = "auto") -> tuple:
+    """Return (summary, cache_hit, mode_used) for an already validated text.
+
+    mode is "abstractive" (LLM only), "extractive" (local only) or "auto",
+    which uses the LLM but falls back to the extractive summarizer when no
+    provider is configured, the provider is saturated, fails or is too slow.
+    """
+    if mode == "extractive":
+        return await summarize_extractive(text), False, "extractive"
+    if not llm_client:
+        if mode == "abstractive":
+            raise LLMUnavailable("No LLM provider is configured")
+        return await summarize_extractive(text), False, "extractive"
+
+    cache_key = summary_cache_key(text, max_tokens=500)
+    summary = None if bypass_cache else await summary_cache.get(cache_key)
+    if summary is not None:
+        return summary, True, "abstractive"
+
+    if mode == "auto" and llm_client.is_saturated():
+        return await summarize_extractive(text), False, "extractive"
+
+    # Use Groq API to generate summary, chunked map-reduce for long documents.
+    # The shared call caches its result even if this caller times out.
+    generation = summary_flight.do(cache_key, lambda: _generate_summary(text, cache_key))
+    try:
+        if mode == "auto":
+            summary = await asyncio.wait_for(generation, SUMMARY_FALLBACK_TIMEOUT)
+        else:
+            summary = await generation
+    except Exception:
+        if mode != "auto":
+            raise
+        return await summarize_extractive(text), False, "extractive"
+    return summary, False, "abstractive"
@@ -0,0 +1,206 @@
+"""
+Bulk export and import of a user's conversations as NDJSON
+
+Each line is a JSON object with a `type` of "history" or "message"; a
+history line comes before the messages of that history. Export reads the
+histories in batches and all their messages from one cursor sorted by
+(history_id, timestamp), import writes with batched insert_many, so
+memory stays flat whatever the number of messages.
+"""
+import json
+import os
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException, status
+from app.database import history_collection, message_collection, history_archive_collection
+from app.utils import mongo_now
+from app.conditional import bump_user_histories
+
+EXPORT_HISTORY_BATCH = int(os.getenv("EXPORT_HISTORY_BATCH", "200"))  # histories per message cursor
+EXPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))  # documents per insert_many
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(1024 * 1024)))
+IMPORT_MAX_ERRORS = 20  # errors reported back
+
+HISTORY_EXPORT_FIELDS = {"created_at": 1, "updated_at": 1, "archived": 1, "messages": 1}
+MESSAGE_EXPORT_FIELDS = {"history_id": 1, "role": 1, "content": 1, "timestamp": 1}
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def ndjson_line(kind: str, doc: dict) -> str:
+    return json.dumps({"type": kind, **doc}, default=_json_default) + "\n"
+
+
+async def _history_lines(history: dict) -> list:
+    lines = [ndjson_line("history", {k: v for k, v in history.items() if k != "archived"})]
+    if history.get("archived"):
+        archive = await history_archive_collection.find_one({"_id": history["_id"]}, {"messages": 1})
+        for message in (archive or {}).get("messages", []):
+            lines.append(ndjson_line("message", {**message, "history_id": str(history["_id"])}))
+    return lines
+
+
+async def _export_batch(histories: list):
+    by_id = {str(history["_id"]): history for history in histories}
+    ids = sorted(by_id)
+    # Equality on history_id lets the (history_id, timestamp, _id) index return the messages in order
+    cursor = message_collection.find(
+        {"history_id": {"$in": ids}},
+        MESSAGE_EXPORT_FIELDS
+    ).sort([("history_id", 1), ("timestamp", 1), ("_id", 1)])
+
+    position = 0
+    async for message in cursor:
+        while position < len(ids) and ids[position] <= message["history_id"]:
+            for line in await _history_lines(by_id[ids[position]]):
+                yield line
+            position += 1
+        yield ndjson_line("message", message)
+    for history_id in ids[position:]:
+        for line in await _history_lines(by_id[history_id]):
+            yield line
+
+
+async def _export_lines(user_id: str):
+    histories = history_collection.find(
+        {"user_id": user_id},
+        HISTORY_EXPORT_FIELDS
+    ).sort([("created_at", 1), ("_id", 1)])
+    batch = []
+    async for history in histories:
+        batch.append(history)
+        if len(batch) == EXPORT_HISTORY_BATCH:
+            async for line in _export_batch(batch):
+                yield line
+            batch = []
+    if batch:
+        async for line in _export_batch(batch):
+            yield line
+
+
+async def export_user(user_id: str):
+    """Yield a user's conversations as NDJSON in chunks of about EXPORT_CHUNK_BYTES"""
+    chunk, size = [], 0
+    async for line in _export_lines(user_id):
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+async def _lines(stream):
+    """Split a byte stream into lines without holding more than one line in memory"""
+    buffer = b""
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Import lines are limited to {IMPORT_MAX_LINE_BYTES} bytes"
+            )
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+def _parse_time(value):
+    if value is None or value == "":
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"expected an ISO timestamp, got {type(value).__name__}")
+    return datetime.fromisoformat(value).replace(tzinfo=None)
+
+
+class Importer:
+    """Writes imported histories and messages in batches, remapping their ids"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.history_ids = {}  # exported id -> new id
+        self.histories = []
+        self.messages = []
+        self.counts = {"histories": 0, "messages": 0}
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line_number: int, reason: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line_number, "error": reason})
+
+    async def add(self, line_number: int, record: dict):
+        kind = record.get("type")
+        if kind == "history":
+            now = mongo_now()
+            doc = {
+                "_id": ObjectId(),
+                "user_id": self.user_id,
+                "created_at": _parse_time(record.get("created_at")) or now,
+                "updated_at": _parse_time(record.get("updated_at")) or now,
+            }
+            if isinstance(record.get("messages"), list):
+                doc["messages"] = record["messages"]
+            # Mapped only once the line is valid, so messages of a rejected history are rejected too
+            self.history_ids[str(record.get("_id"))] = str(doc["_id"])
+            self.histories.append(doc)
+        elif kind == "message":
+            history_id = self.history_ids.get(str(record.get("history_id")))
+            if history_id is None:
+                return self.error(line_number, "Message before its history")
+            if not isinstance(record.get("role"), str) or not isinstance(record.get("content"), str):
+                return self.error(line_number, "Message needs a role and a content")
+            self.messages.append({
+                "_id": ObjectId(),
+                "history_id": history_id,
+                "user_id": self.user_id,
+                "role": record["role"],
+                "content": record["content"],
+                "timestamp": _parse_time(record.get("timestamp")) or mongo_now(),
+            })
+        else:
+            return self.error(line_number, f"Unknown record type {kind!r}")
+        if len(self.histories) + len(self.messages) >= IMPORT_BATCH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self.histories:
+            await history_collection.insert_many(self.histories, ordered=False)
+            self.counts["histories"] += len(self.histories)
+            self.histories = []
+        if self.messages:
+            await message_collection.insert_many(self.messages, ordered=False)
+            self.counts["messages"] += len(self.messages)
+            self.messages = []
+
+
+async def import_user(user_id: str, stream) -> dict:
+    """Import NDJSON produced by export_user for user_id; returns counts and the first errors"""
+    importer = Importer(user_id)
+    line_number = 0
+    async for line in _lines(stream):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("not an object")
+            await importer.add(line_number, record)
+        except (ValueError, TypeError) as e:
+            importer.error(line_number, f"Invalid record: {e}")
+    await importer.flush()
+    if importer.counts["histories"]:
+        await bump_user_histories(user_id)
+    return {**importer.counts, "errors": importer.error_count, "error_details": importer.errors}
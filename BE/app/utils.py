@@ -1,3 +1,12 @@
+import json
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+
+
+# Projections with just the fields the helpers below read (_id is always returned)
+MESSAGE_FIELDS = {"history_id": 1, "role": 1, "content": 1, "timestamp": 1}
+HISTORY_FIELDS = {"user_id": 1, "created_at": 1}
+
 
 def user_helper(user) -> dict:
     return {
@@ -21,3 +30,17 @@ def history_helper(history) -> dict:
         "user_id": str(history.get("user_id", "")),
         "created_at": history.get("created_at", None),
     }
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format a Server-Sent Events frame with a JSON payload"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(jsonable_encoder(data))}\n\n"
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+def mongo_now() -> datetime:
+    """Current UTC time truncated to the millisecond precision MongoDB stores"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
@@ -0,0 +1,67 @@
+"""
+Login throughput benchmark for password verification
+
+Runs N concurrent password checks, once inline on the event loop (the old
+behaviour) and once on the hashing pool, and reports logins per second and
+the worst event-loop stall seen by a ticker task during the run.
+
+    python -m benchmarks.bench_login --logins 64 --concurrency 32 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _ticker(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Return the largest delay between scheduled and actual wake-ups"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def _run(check, password: str, hashed: str, logins: int, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            assert await check(password, hashed)
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return logins / elapsed, await ticker
+
+
+async def main(args):
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    from app import auth
+
+    password = "correct horse battery staple"
+    hashed = auth.get_password_hash(password)
+
+    async def inline_check(plain, stored):
+        return auth.verify_password(plain, stored)
+
+    print(f"bcrypt rounds={args.rounds} logins={args.logins} concurrency={args.concurrency} "
+          f"pool workers={auth.PASSWORD_HASH_WORKERS}")
+    for name, check in (("inline", inline_check), ("pool", auth.check_password)):
+        throughput, stall = await _run(check, password, hashed, args.logins, args.concurrency)
+        print(f"{name:8} {throughput:8.1f} logins/s   max loop stall {stall * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=12)
+    asyncio.run(main(parser.parse_args()))
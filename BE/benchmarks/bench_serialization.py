@@ -0,0 +1,83 @@
+"""
+Serialization cost of a message listing, per listed message
+
+Encodes one page of messages the way GET /api/messages/history/{id}
+used to (full documents, response_model=dict validation, jsonable_encoder
+and the standard JSON encoder) and the way it does now (projected
+documents rendered straight by ORJSONResponse), and reports the CPU time
+per message of each.
+
+    python -m benchmarks.bench_serialization --messages 500 --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+_RESPONSE_MODEL = TypeAdapter(dict)  # response_model=dict
+
+
+def _documents(count: int, projected: bool) -> list:
+    from bson import ObjectId
+    from app.utils import MESSAGE_FIELDS
+
+    history_id = str(ObjectId())
+    start = datetime(2024, 1, 1)
+    docs = []
+    for i in range(count):
+        doc = {
+            "_id": ObjectId(),
+            "history_id": history_id,
+            "role": "user" if i % 2 else "assistant",
+            "content": "A reasonably sized chat message about summarizing documents. " * 4,
+            "timestamp": start + timedelta(seconds=i),
+            # Fields a listing does not return, dropped by the projection
+            "tokens": 60,
+            "metadata": {"model": "llama-3.3-70b-versatile", "latency_ms": 812},
+        }
+        docs.append({k: v for k, v in doc.items() if k == "_id" or k in MESSAGE_FIELDS} if projected else doc)
+    return docs
+
+
+def _old(docs: list) -> bytes:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from app.utils import message_helper
+
+    content = {"messages": [message_helper(doc) for doc in docs], "next_cursor": None, "has_more": False}
+    content = _RESPONSE_MODEL.validate_python(content)
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def _new(docs: list) -> bytes:
+    from fastapi.responses import ORJSONResponse
+    from app.utils import message_helper
+
+    content = {"messages": [message_helper(doc) for doc in docs], "next_cursor": None, "has_more": False}
+    return ORJSONResponse(content).body
+
+
+def _measure(encode, docs: list, repeat: int) -> float:
+    encode(docs)  # imports and warm-up
+    start = time.process_time()
+    for _ in range(repeat):
+        encode(docs)
+    return (time.process_time() - start) / (repeat * len(docs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    old = _measure(_old, _documents(args.messages, projected=False), args.repeat)
+    new = _measure(_new, _documents(args.messages, projected=True), args.repeat)
+    print(f"messages={args.messages} repeat={args.repeat}")
+    print(f"{'old':8} {old * 1e6:8.2f} us/message")
+    print(f"{'new':8} {new * 1e6:8.2f} us/message   {old / new:5.1f}x")
@@ -0,0 +1,96 @@
+"""
+OpenAI-compatible stand-in for the Groq API with a fixed latency and token rate
+
+Serves POST /openai/v1/chat/completions, streaming or not, and echoes the
+start of the last message. Point the app at it with GROQ_BASE_URL so the
+real Groq client, HTTP pool and retries are exercised without network calls.
+
+    python -m benchmarks.fake_llm_server --port 8100 --latency 0.5 --token-rate 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+app.state.latency = 0.5
+app.state.token_rate = 200.0
+
+
+def _tokens(body: dict) -> list:
+    messages = body.get("messages") or []
+    prompt = messages[-1].get("content", "") if messages else ""
+    return prompt.split()[:max(1, body.get("max_tokens", 500) // 4)] or ["ok"]
+
+
+def _usage(body: dict, tokens: list) -> dict:
+    prompt_tokens = sum(len(m.get("content") or "") for m in body.get("messages") or []) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None, **extra) -> str:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        **extra,
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    tokens = _tokens(body)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    latency = request.app.state.latency
+    token_rate = request.app.state.token_rate
+
+    if body.get("stream"):
+        async def events():
+            await asyncio.sleep(latency)
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                yield _chunk(completion_id, model, {"content": token if i == 0 else " " + token})
+                await asyncio.sleep(1 / token_rate)
+            yield _chunk(completion_id, model, {}, "stop", x_groq={"usage": _usage(body, tokens)})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(latency + len(tokens) / token_rate)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": " ".join(tokens)},
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(body, tokens),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="tokens per second")
+    args = parser.parse_args()
+    app.state.latency = args.latency
+    app.state.token_rate = args.token_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,428 @@
+"""
+Load test: drive realistic request mixes against the API and report latency percentiles
+
+Starts the fake LLM server and the app as subprocesses (or targets a
+running server with --base-url), registers and logs in a pool of users,
+then runs each scenario with N closed-loop clients per concurrency level
+for a fixed duration. Results are printed and written as JSON tagged with
+the git commit, so runs on different commits can be compared.
+
+Scenarios:
+    login      login bursts (bcrypt bound)
+    chat       multi-turn conversations through POST /api/messages/
+    history    paging through the history list and one conversation
+    summarize  batch summarization over a pool of documents
+    mixed      40% chat, 40% history, 10% summarize, 10% login
+
+    python -m benchmarks.load_test --memory-db --concurrency 1,16,64 --duration 15
+    python -m benchmarks.load_test --mongodb-url mongodb://localhost:27017 \\
+        --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import httpx
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BE_DIR, "benchmarks", "results")
+PASSWORD = "benchmark-password"
+
+WORDS = (
+    "model data system network latency request database index query cache token summary "
+    "user history message stream worker queue batch document section result server client "
+    "throughput memory process thread event loop pool connection retry error budget limit"
+).split()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _git(*args) -> str:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=BE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    """Pseudo-random prose, deterministic for a given seed"""
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+class Recorder:
+    """Latencies and error counts per operation"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, op: str, seconds: float, ok: bool):
+        self.latencies.setdefault(op, []).append(seconds)
+        if not ok:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    def rows(self, elapsed: float) -> list:
+        rows = []
+        for op, values in sorted(self.latencies.items()):
+            values.sort()
+            rows.append({
+                "op": op,
+                "count": len(values),
+                "errors": self.errors.get(op, 0),
+                "throughput": len(values) / elapsed,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            })
+        return rows
+
+
+class Context:
+    """Shared state of one run: HTTP client, users and documents"""
+
+    def __init__(self, args, http: httpx.AsyncClient):
+        self.args = args
+        self.http = http
+        self.users = []  # (email, token)
+        self.rng = random.Random(args.seed)
+        self.documents = [
+            make_text(self.rng, args.summarize_words) for _ in range(args.summarize_documents)
+        ]
+        self.recorder = None
+
+    async def call(self, op: str, method: str, url: str, token: str = None, **kwargs):
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        if self.recorder is not None:
+            self.recorder.add(op, time.perf_counter() - start, ok)
+        return response if ok else None
+
+
+async def login_op(ctx: Context, state: dict):
+    email, _ = ctx.rng.choice(ctx.users)
+    await ctx.call("login", "POST", "/api/auth/login", json={"email": email, "password": PASSWORD})
+
+
+async def chat_op(ctx: Context, state: dict):
+    if state.get("turns", 0) >= ctx.args.chat_turns:
+        state.pop("history_id", None)
+        state["turns"] = 0
+    payload = {"role": "user", "content": make_text(ctx.rng, ctx.args.chat_words)}
+    if state.get("history_id"):
+        payload["history_id"] = state["history_id"]
+    response = await ctx.call("chat_turn", "POST", "/api/messages/", state["token"], json=payload)
+    if response is not None:
+        state["history_id"] = response.json()["history_id"]
+        state["turns"] = state.get("turns", 0) + 1
+
+
+async def history_op(ctx: Context, state: dict):
+    cursor, first = None, None
+    for _ in range(ctx.args.history_pages):
+        params = {"limit": 20, **({"cursor": cursor} if cursor else {})}
+        response = await ctx.call("history_page", "GET", "/api/history/", state["token"], params=params)
+        if response is None:
+            return
+        page = response.json()
+        if first is None and page["history"]:
+            first = page["history"][0]["_id"]
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    if first:
+        await ctx.call("history_messages", "GET", f"/api/messages/history/{first}", state["token"],
+                       params={"limit": 50})
+
+
+async def summarize_op(ctx: Context, state: dict):
+    items = [
+        {"text": ctx.rng.choice(ctx.documents), "bypass_cache": ctx.args.bypass_cache}
+        for _ in range(ctx.args.batch_size)
+    ]
+    await ctx.call("summarize_batch", "POST", "/api/summarize/batch", state["token"], json={"items": items})
+
+
+MIXED = ((chat_op, 40), (history_op, 40), (summarize_op, 10), (login_op, 10))
+
+
+async def mixed_op(ctx: Context, state: dict):
+    ops, weights = zip(*MIXED)
+    await ctx.rng.choices(ops, weights)[0](ctx, state)
+
+
+SCENARIOS = {
+    "login": login_op,
+    "chat": chat_op,
+    "history": history_op,
+    "summarize": summarize_op,
+    "mixed": mixed_op,
+}
+
+
+async def setup_users(ctx: Context):
+    """Register and log in the user pool, then give each user some conversations"""
+    run = f"{int(time.time())}{ctx.rng.randrange(10000)}"
+    semaphore = asyncio.Semaphore(16)
+
+    async def create(i: int):
+        async with semaphore:
+            email = f"bench-{run}-{i}@example.com"
+            await ctx.call("setup", "POST", "/api/auth/register",
+                           json={"username": f"bench-{run}-{i}", "email": email, "password": PASSWORD})
+            response = await ctx.call("setup", "POST", "/api/auth/login",
+                                      json={"email": email, "password": PASSWORD})
+            if response is None:
+                raise RuntimeError(f"Could not log in {email}")
+            token = response.json()["access_token"]
+            # Assistant-role messages are stored without an LLM call
+            for _ in range(ctx.args.seed_histories):
+                response = await ctx.call("setup", "POST", "/api/messages/", token,
+                                          json={"role": "assistant", "content": make_text(ctx.rng, 30)})
+                history_id = response.json()["history_id"]
+                for _ in range(ctx.args.seed_messages - 1):
+                    await ctx.call("setup", "POST", "/api/messages/", token, json={
+                        "role": "assistant", "content": make_text(ctx.rng, 30), "history_id": history_id
+                    })
+            return email, token
+
+    ctx.users = await asyncio.gather(*(create(i) for i in range(ctx.args.users)))
+
+
+async def run_level(ctx: Context, scenario: str, concurrency: int, duration: float) -> tuple:
+    """Run concurrency closed-loop clients for duration seconds"""
+    op = SCENARIOS[scenario]
+    recorder = Recorder()
+    ctx.recorder = recorder
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+
+    async def client(i: int):
+        _, token = ctx.users[i % len(ctx.users)]
+        state = {"token": token}
+        while loop.time() < deadline:
+            await op(ctx, state)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ctx.recorder = None
+    return recorder, elapsed
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout}s")
+
+
+def start_stack(args) -> tuple:
+    """Start the fake LLM server and the app; return (base_url, processes)"""
+    processes = []
+    env = {
+        **os.environ,
+        "DATABASE_NAME": args.database,
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        # Benchmarks measure the server, not the per-user limits
+        "RATE_LIMIT_REQUESTS_PER_MINUTE": "1000000000",
+        "RATE_LIMIT_REQUEST_BURST": "1000000000",
+        "RATE_LIMIT_TOKENS_PER_MINUTE": "1000000000000",
+        "RATE_LIMIT_TOKEN_BURST": "1000000000000",
+        "USER_MAX_CONCURRENT_REQUESTS": "1000000",
+    }
+    if args.mongodb_url:
+        env["MONGODB_URL"] = args.mongodb_url
+
+    if args.llm == "server":
+        llm_port = _free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_llm_server", "--port", str(llm_port),
+             "--latency", str(args.llm_latency), "--token-rate", str(args.llm_token_rate)],
+            cwd=BE_DIR
+        ))
+        _wait_ready(f"http://127.0.0.1:{llm_port}/docs", processes[-1])
+        env.update({
+            "LLM_PROVIDER": "groq",
+            "GROQ_API_KEY": "benchmark",
+            "GROQ_BASE_URL": f"http://127.0.0.1:{llm_port}",  # read by the Groq SDK
+        })
+    else:
+        env.update({
+            "LLM_PROVIDER": "fake",
+            "FAKE_LLM_LATENCY": str(args.llm_latency),
+            "FAKE_LLM_TOKEN_RATE": str(args.llm_token_rate),
+        })
+
+    app_port = _free_port()
+    command = [sys.executable, "-m", "benchmarks.serve_app", "--port", str(app_port)]
+    if args.memory_db:
+        command.append("--memory-db")
+    processes.append(subprocess.Popen(command, cwd=BE_DIR, env=env))
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        _wait_ready(base_url + "/", processes[-1])
+    except RuntimeError:
+        stop_stack(processes)
+        raise
+    return base_url, processes
+
+
+def stop_stack(processes: list):
+    for process in reversed(processes):
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def compare(results: dict, baseline_path: str):
+    """Print throughput and p95 changes against a previous result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["scenario"], r["concurrency"], r["op"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('git_sha', '?')[:10]} ({baseline_path})")
+    print(f"{'scenario':10} {'conc':>5} {'op':18} {'req/s':>12} {'p95':>12}")
+    for row in results["results"]:
+        old = previous.get((row["scenario"], row["concurrency"], row["op"]))
+        if not old:
+            continue
+        throughput = (row["throughput"] / old["throughput"] - 1) * 100 if old["throughput"] else 0.0
+        p95 = (row["p95_ms"] / old["p95_ms"] - 1) * 100 if old["p95_ms"] else 0.0
+        print(f"{row['scenario']:10} {row['concurrency']:>5} {row['op']:18} {throughput:>+11.1f}% {p95:>+11.1f}%")
+
+
+async def run(args, base_url: str) -> list:
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 16, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as http:
+        ctx = Context(args, http)
+        await setup_users(ctx)
+        results = []
+        print(f"{'scenario':10} {'conc':>5} {'op':18} {'count':>7} {'err':>5} {'req/s':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await run_level(ctx, scenario, concurrency, args.warmup)
+                recorder, elapsed = await run_level(ctx, scenario, concurrency, args.duration)
+                for row in recorder.rows(elapsed):
+                    row = {"scenario": scenario, "concurrency": concurrency, **row}
+                    results.append(row)
+                    print(f"{scenario:10} {concurrency:>5} {row['op']:18} {row['count']:>7} {row['errors']:>5} "
+                          f"{row['throughput']:>9.1f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+                          f"{row['p99_ms']:>9.1f}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", default="login,chat,history,summarize,mixed",
+                        type=lambda s: s.split(","))
+    parser.add_argument("--concurrency", default="1,16,64", type=lambda s: [int(c) for c in s.split(",")])
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario and level")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds discarded before each level")
+    parser.add_argument("--base-url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--mongodb-url", help="MongoDB for the started app (default: MONGODB_URL)")
+    parser.add_argument("--memory-db", action="store_true", help="use mongomock-motor instead of MongoDB")
+    parser.add_argument("--database", default=f"bench_{int(time.time())}", help="dropped afterwards")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument("--llm", choices=("server", "inprocess"), default="server",
+                        help="fake OpenAI-compatible server behind the Groq client, or the in-process fake")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-token-rate", type=float, default=200)
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--seed-histories", type=int, default=30, help="conversations per user before the run")
+    parser.add_argument("--seed-messages", type=int, default=4, help="messages per seeded conversation")
+    parser.add_argument("--chat-turns", type=int, default=5, help="turns before a client starts a new chat")
+    parser.add_argument("--chat-words", type=int, default=40)
+    parser.add_argument("--history-pages", type=int, default=3)
+    parser.add_argument("--summarize-documents", type=int, default=50, help="distinct documents in the pool")
+    parser.add_argument("--summarize-words", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--bypass-cache", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<sha>-<time>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario {scenario!r}, choose from {', '.join(SCENARIOS)}")
+
+    processes = []
+    base_url = args.base_url
+    if not base_url:
+        base_url, processes = start_stack(args)
+    try:
+        rows = asyncio.run(run(args, base_url))
+    finally:
+        stop_stack(processes)
+        if processes and not args.memory_db and not args.keep_db:
+            from pymongo import MongoClient
+            url = args.mongodb_url or os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+            MongoClient(url).drop_database(args.database)
+
+    sha = _git("rev-parse", "HEAD")
+    now = datetime.now(timezone.utc)
+    results = {
+        "git_sha": sha,
+        "git_dirty": bool(_git("status", "--porcelain", "--", ".")),
+        "timestamp": now.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": rows,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{sha[:10] or 'nogit'}-{now:%Y%m%dT%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
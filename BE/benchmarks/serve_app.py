@@ -0,0 +1,46 @@
+"""
+Run the API for benchmarks, against MongoDB or an in-memory stand-in
+
+With --memory-db the collections in app.database are replaced by
+mongomock-motor ones before the app is imported. That needs
+`pip install mongomock-motor` and only makes sense for comparing the
+Python side of a change: there is no network hop and no real query planner.
+
+    python -m benchmarks.serve_app --port 8200 [--memory-db]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def use_memory_db():
+    try:
+        import mongomock_motor
+    except ImportError:
+        sys.exit("--memory-db needs mongomock-motor: pip install mongomock-motor")
+    from app import database
+
+    client = mongomock_motor.AsyncMongoMockClient()
+    db = client[database.DATABASE_NAME]
+    database.client = client
+    database.database = db
+    for name, value in list(vars(database).items()):
+        if name.endswith("_collection"):
+            setattr(database, name, db.get_collection(value.name))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--memory-db", action="store_true")
+    args = parser.parse_args()
+    if args.memory_db:
+        use_memory_db()
+
+    import uvicorn
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -1,5 +1,5 @@
 """
-Quick start script for the FastAPI backend
+Quick start script for the FastAPI backend (development, reloads on changes; use serve.py in production)
 """
 import uvicorn
 
@@ -0,0 +1,75 @@
+"""
+Production launcher: several uvicorn worker processes sharing one port
+
+Indexes are created once here before the workers start, so each worker
+only opens its pools and warms up. MONGO_MAX_CONNECTIONS, when set, is
+the Mongo connection budget of the whole server and is split evenly
+between the workers. With more than one worker the metrics of all
+workers are merged through a shared PROMETHEUS_MULTIPROC_DIR.
+
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import asyncio
+import glob
+import os
+import tempfile
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def default_workers() -> int:
+    # The app is I/O bound on one event loop per process: one worker per core
+    return int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def prepare_metrics_dir(workers: int):
+    """Share metrics between workers through PROMETHEUS_MULTIPROC_DIR, emptied on every start"""
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path and workers > 1:
+        path = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="text-summarizer-metrics-")
+    if path:
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, "*.json")):
+            os.remove(stale)
+
+
+def create_indexes():
+    from app.database import client
+    from app.indexes import ensure_indexes
+    try:
+        asyncio.run(ensure_indexes())
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="seconds open requests get to finish on shutdown")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+
+    total = os.getenv("MONGO_MAX_CONNECTIONS")
+    if total and "MONGO_MAX_POOL_SIZE" not in os.environ:
+        os.environ["MONGO_MAX_POOL_SIZE"] = str(max(int(total) // args.workers, 1))
+
+    prepare_metrics_dir(args.workers)
+    create_indexes()
+    os.environ["ENSURE_INDEXES_ON_STARTUP"] = "false"  # inherited by the workers
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        proxy_headers=True,
+        access_log=args.access_log,
+        timeout_graceful_shutdown=args.graceful_timeout
+    )